@@ -0,0 +1,77 @@
+"""
+Import-time check for the runners.
+
+Imports each runner module in a fresh interpreter several times and reports the
+best wall-clock import time, and fails if it exceeds its budget or if a runner
+pulls in modules it must not need (e.g. Pillow in the manager runner).
+
+Usage:
+    PYTHONPATH=src python benchmarks/import_time.py
+    PYTHONPATH=src python benchmarks/import_time.py --budget-scale 2   # slow CI machine
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> (budget in ms on a developer laptop, modules it must not import)
+RUNNERS = {
+    "runners.run_manager": (500, ("PIL", "aiohttp", "bots.arg_bot", "bots.rendering")),
+    "runners.run_arg": (800, ("bots.manager_bot",)),
+    "runners.run_render_worker": (800, ("bots.arg_bot", "bots.manager_bot")),
+}
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(module: str) -> dict:
+    env = {**os.environ, "PYTHONPATH": os.path.join(ROOT, "src")}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every budget by this factor")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    failures = []
+    results = {}
+    for module, (budget_ms, forbidden) in RUNNERS.items():
+        samples = [measure(module) for _ in range(args.runs)]
+        best_ms = min(sample["seconds"] for sample in samples) * 1000
+        budget_ms *= args.budget_scale
+        leaked = [name for name in forbidden if name in samples[0]["modules"]]
+        results[module] = {"best_ms": best_ms, "budget_ms": budget_ms, "modules": len(samples[0]["modules"])}
+
+        print(f"{module:<28}{best_ms:>9.1f} ms  (budget {budget_ms:.0f} ms, {len(samples[0]['modules'])} modules)")
+        if best_ms > budget_ms:
+            failures.append(f"{module} imports in {best_ms:.1f} ms, budget is {budget_ms:.0f} ms")
+        if leaked:
+            failures.append(f"{module} imports {', '.join(leaked)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    for line in failures:
+        print(f"REGRESSION {line}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+Rendering benchmark for the "#arg" overlay.
+
+Runs the stages behind ArgBot.draw_arg_on_image / ArgBot.fit_fonts over a matrix of
+generated photos (thumbnail to 4K, landscape and portrait, RGB/RGBA/palette) and
+reports per-stage timings, throughput and peak memory.
+
+Usage:
+    PYTHONPATH=src python benchmarks/render_bench.py --output results.json
+    PYTHONPATH=src python benchmarks/render_bench.py --compare results.json
+"""
+import argparse
+import dataclasses
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import sys
+import time
+from io import BytesIO
+
+import PIL
+from PIL import Image
+
+SIZES = {
+    "thumb": (320, 240),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+ORIENTATIONS = ("landscape", "portrait")
+MODES = ("RGB", "RGBA", "P")
+STAGES = ("decode", "font_fit", "draw", "encode", "total")
+
+
+def make_source(width: int, height: int, mode: str) -> bytes:
+    """
+    Generate a noisy photo-like image and encode it the way Telegram users send it:
+    JPEG for RGB, PNG for images with alpha or a palette.
+    """
+    image = Image.merge("RGB", [Image.effect_noise((width, height), sigma) for sigma in (40, 60, 80)])
+    if mode == "RGBA":
+        image.putalpha(Image.linear_gradient("L").resize((width, height)))
+    elif mode == "P":
+        image = image.quantize(256)
+
+    output = BytesIO()
+    image.save(output, "JPEG" if mode == "RGB" else "PNG")
+    return output.getvalue()
+
+
+def _percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _read_status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_peak_rss() -> int:
+    """
+    Reset the peak RSS high-water mark where the OS allows it (Linux) and return
+    the current RSS in bytes, to be subtracted from the later peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _read_status_kb("VmRSS") * 1024
+    except OSError:
+        return _peak_rss()
+
+
+def _peak_rss() -> int:
+    try:
+        return _read_status_kb("VmHWM") * 1024
+    except OSError:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(job: tuple) -> dict:
+    """
+    Benchmark one matrix cell. Runs in a fresh process so that the reported peak
+    memory belongs to this case only; the source photo is generated by the parent.
+    """
+    from bots.rendering import EncodeSettings, decode_image, encode_jpeg, font_cache, stamp_image
+
+    case, source = job
+    baseline_rss = _reset_peak_rss()
+    timings = {stage: [] for stage in STAGES}
+    settings = EncodeSettings(**case["encode"])
+
+    for iteration in range(case["warmup"] + case["iterations"]):
+        started = time.perf_counter()
+
+        image = decode_image(source, case["target_resolution"], settings.max_dimension)
+        image.load()
+        decoded = time.perf_counter()
+
+        font_cache.fit(image.width, image.height)
+        fitted = time.perf_counter()
+
+        stamp_image(image)
+        drawn = time.perf_counter()
+
+        output = encode_jpeg(image, settings)
+        encoded = time.perf_counter()
+
+        if iteration < case["warmup"]:
+            continue
+        timings["decode"].append(decoded - started)
+        timings["font_fit"].append(fitted - decoded)
+        timings["draw"].append(drawn - fitted)
+        timings["encode"].append(encoded - drawn)
+        timings["total"].append(encoded - started)
+
+    peak_rss = _peak_rss()
+
+    return {
+        **case,
+        "source_bytes": len(source),
+        "output_bytes": len(output),
+        "stages_ms": {
+            stage: {
+                "median": statistics.median(samples) * 1000,
+                "p95": _percentile(samples, 95) * 1000,
+            }
+            for stage, samples in timings.items()
+        },
+        "throughput_ips": len(timings["total"]) / sum(timings["total"]),
+        "peak_memory_mb": max(0, peak_rss - baseline_rss) / 2 ** 20,
+        "font_cache": font_cache.stats(),
+    }
+
+
+def build_matrix(args) -> list:
+    from bots.rendering import EncodeSettings
+
+    # ARG_JPEG_* / ARG_MAX_DIMENSION / ARG_TARGET_BYTES select the encoder settings, as in the bot
+    encode = dataclasses.asdict(EncodeSettings.from_env())
+    cases = []
+    for size_name, (width, height) in SIZES.items():
+        if args.sizes and size_name not in args.sizes:
+            continue
+        for orientation in ORIENTATIONS:
+            w, h = (width, height) if orientation == "landscape" else (height, width)
+            for mode in MODES:
+                cases.append({
+                    "name": f"{size_name}-{orientation}-{mode}",
+                    "width": w,
+                    "height": h,
+                    "mode": mode,
+                    "iterations": args.iterations,
+                    "warmup": args.warmup,
+                    "target_resolution": args.target_resolution,
+                    "encode": encode,
+                })
+    return cases
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> list:
+    """
+    Return the cases whose median total time regressed by more than `threshold` (fraction).
+    """
+    with open(baseline_path) as f:
+        baseline = {case["name"]: case for case in json.load(f)["results"]}
+
+    regressions = []
+    for case in results:
+        previous = baseline.get(case["name"])
+        if not previous:
+            continue
+        before = previous["stages_ms"]["total"]["median"]
+        after = case["stages_ms"]["total"]["median"]
+        if before and (after - before) / before > threshold:
+            regressions.append(f"{case['name']}: {before:.2f}ms -> {after:.2f}ms")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--sizes", nargs="*", choices=list(SIZES), help="Limit the matrix to these sizes")
+    parser.add_argument("--target-resolution", type=int, default=None,
+                        help="Longest side to draft-decode JPEGs to (ARG_TARGET_RESOLUTION)")
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown vs. baseline")
+    args = parser.parse_args()
+
+    jobs = [(case, make_source(case["width"], case["height"], case["mode"])) for case in build_matrix(args)]
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        results = pool.map(run_case, jobs, chunksize=1)
+
+    print(f"{'case':<24}" + "".join(f"{stage:>10}" for stage in STAGES) + f"{'img/s':>9}{'peak MB':>9}{'out KB':>9}")
+    for case in results:
+        stages = "".join(f"{case['stages_ms'][stage]['median']:>10.2f}" for stage in STAGES)
+        print(
+            f"{case['name']:<24}{stages}{case['throughput_ips']:>9.1f}{case['peak_memory_mb']:>9.1f}"
+            f"{case['output_bytes'] / 1024:>9.0f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "pillow": PIL.__version__,
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Local stand-in for the Telegram Bot API, for load-testing ArgBot and ArgManagerBot
+without touching real Telegram.
+
+Implements the subset of methods the bots use (getMe, getUpdates, getFile plus file
+downloads, sendPhoto/sendMessage/sendAudio/... , forwardMessage(s), sendMediaGroup,
+export/createChatInviteLink) with configurable latency, 429 RetryAfter injection and
+random failures. Point the runners at it with
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot
+    TELEGRAM_FILE_URL=http://127.0.0.1:8081/file/bot
+
+Run standalone with `python loadtest/fake_bot_api.py --port 8081`, or embed FakeBotApi
+in a harness (see loadtest/harness.py) to inject updates and observe sent messages.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from aiohttp import web
+
+SEND_METHODS = {
+    "sendPhoto": "photo",
+    "sendMessage": "text",
+    "sendAudio": "audio",
+    "sendVideo": "video",
+    "sendDocument": "document",
+    "sendSticker": "sticker",
+}
+
+
+@dataclass
+class FaultConfig:
+    latency: float = 0.05
+    jitter: float = 0.02
+    # probability of answering a send with 429 Too Many Requests
+    retry_after_rate: float = 0.0
+    retry_after: int = 1
+    # probability of answering any call with a 500 error
+    failure_rate: float = 0.0
+
+
+@dataclass
+class SentMessage:
+    token: str
+    method: str
+    chat_id: int
+    message_id: int
+    reply_to_message_id: Optional[int]
+    received_at: float
+    params: dict = field(repr=False, default_factory=dict)
+
+
+class FakeBotApi:
+    def __init__(self, faults: Optional[FaultConfig] = None):
+        self.faults = faults or FaultConfig()
+        self.updates: dict[str, list] = defaultdict(list)
+        self._update_events: dict[str, asyncio.Event] = defaultdict(asyncio.Event)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.files: dict[str, bytes] = {}
+        self.sent: list[SentMessage] = []
+        self.on_sent: list[Callable[[SentMessage], None]] = []
+        self.counters: dict[str, int] = defaultdict(int)
+        self.polling_tokens: set = set()
+
+    # -- harness API -------------------------------------------------------------
+
+    def add_file(self, data: bytes, file_id: Optional[str] = None) -> str:
+        file_id = file_id or f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = data
+        return file_id
+
+    def next_message_id(self) -> int:
+        return next(self._message_ids)
+
+    def push_update(self, token: str, update: dict) -> int:
+        """
+        Queue an update for the bot with `token`; returns its update_id.
+        """
+        update = {"update_id": next(self._update_ids), **update}
+        self.updates[token].append(update)
+        self._update_events[token].set()
+        return update["update_id"]
+
+    # -- Bot API -----------------------------------------------------------------
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 2 ** 20)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.*}", self.handle_file)
+        app.router.add_get("/_control/stats", self.handle_stats)
+        return app
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters) -> web.Response:
+        payload = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return web.json_response(payload, status=code)
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            params[key] = value.file.read() if hasattr(value, "file") else value
+        return params
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.counters[f"calls.{method}"] += 1
+
+        if method != "getUpdates":
+            await asyncio.sleep(max(0.0, random.gauss(self.faults.latency, self.faults.jitter)))
+            if random.random() < self.faults.failure_rate:
+                self.counters["injected.500"] += 1
+                return self._error(500, "Internal Server Error: injected failure")
+            if method in SEND_METHODS or method.startswith("forward") or method == "sendMediaGroup":
+                if random.random() < self.faults.retry_after_rate:
+                    self.counters["injected.429"] += 1
+                    return self._error(
+                        429, f"Too Many Requests: retry after {self.faults.retry_after}",
+                        retry_after=self.faults.retry_after,
+                    )
+
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            if method in SEND_METHODS:
+                return self._ok(self._record_send(token, method, params))
+            # setMyCommands, deleteWebhook, close, ... are accepted and ignored
+            return self._ok(True)
+        return await handler(token, params)
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        data = self.files.get(request.match_info["path"])
+        if data is None:
+            return web.Response(status=404)
+        await asyncio.sleep(max(0.0, random.gauss(self.faults.latency, self.faults.jitter)))
+        return web.Response(body=data)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"counters": self.counters, "sent": len(self.sent)})
+
+    async def api_getMe(self, token: str, params: dict) -> web.Response:
+        bot_id = int(token.split(":")[0]) if token.split(":")[0].isdigit() else abs(hash(token)) % 10 ** 9
+        return self._ok({
+            "id": bot_id, "is_bot": True, "first_name": f"fake-{bot_id}", "username": f"fake_{bot_id}_bot",
+            "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False,
+        })
+
+    async def api_getUpdates(self, token: str, params: dict) -> web.Response:
+        self.polling_tokens.add(token)
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+
+        queue = self.updates[token]
+        # confirmed updates are dropped, as with the real API
+        queue[:] = [u for u in queue if u["update_id"] >= offset]
+        if not queue and timeout:
+            event = self._update_events[token]
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._ok(queue[:limit])
+
+    async def api_getFile(self, token: str, params: dict) -> web.Response:
+        file_id = params["file_id"]
+        if file_id not in self.files:
+            return self._error(400, "Bad Request: invalid file_id")
+        return self._ok({
+            "file_id": file_id, "file_unique_id": f"u-{file_id}",
+            "file_size": len(self.files[file_id]), "file_path": file_id,
+        })
+
+    def _store_upload(self, value) -> dict:
+        """
+        Turn an uploaded file (bytes) or a reused file_id (str) into a file object.
+        """
+        if isinstance(value, bytes):
+            file_id = self.add_file(value)
+        else:
+            file_id = value
+        return {"file_id": file_id, "file_unique_id": f"u-{file_id}", "file_size": len(self.files.get(file_id, b""))}
+
+    def _record_send(self, token: str, method: str, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        reply_to = params.get("reply_to_message_id")
+        if params.get("reply_parameters"):
+            reply_parameters = params["reply_parameters"]
+            if isinstance(reply_parameters, str):
+                reply_parameters = json.loads(reply_parameters)
+            reply_to = reply_parameters.get("message_id")
+
+        message = {
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+        }
+        kind = SEND_METHODS.get(method)
+        if kind == "text":
+            message["text"] = params.get("text", "")
+        elif kind == "photo":
+            photo = self._store_upload(params["photo"])
+            message["photo"] = [{**photo, "width": 1280, "height": 960}]
+        elif kind == "audio":
+            message["audio"] = {**self._store_upload(params["audio"]), "duration": int(params.get("duration") or 0)}
+        elif kind in ("video", "document", "sticker"):
+            extra = {"width": 512, "height": 512, "duration": 0} if kind == "video" else {}
+            if kind == "sticker":
+                extra = {"width": 512, "height": 512, "is_animated": False, "is_video": False, "type": "regular"}
+            message[kind] = {**self._store_upload(params[kind]), **extra}
+
+        sent = SentMessage(
+            token=token, method=method, chat_id=chat_id, message_id=message["message_id"],
+            reply_to_message_id=int(reply_to) if reply_to else None, received_at=time.perf_counter(),
+            params={k: v for k, v in params.items() if not isinstance(v, bytes)},
+        )
+        self.sent.append(sent)
+        self.counters[f"sent.{method}"] += 1
+        for callback in self.on_sent:
+            callback(sent)
+        return message
+
+    async def api_forwardMessage(self, token: str, params: dict) -> web.Response:
+        return self._ok(self._record_send(token, "forwardMessage", params))
+
+    async def api_forwardMessages(self, token: str, params: dict) -> web.Response:
+        message_ids = params["message_ids"]
+        if isinstance(message_ids, str):
+            message_ids = json.loads(message_ids)
+        results = [self._record_send(token, "forwardMessages", params) for _ in message_ids]
+        return self._ok([{"message_id": m["message_id"]} for m in results])
+
+    async def api_sendMediaGroup(self, token: str, params: dict) -> web.Response:
+        media = params["media"]
+        if isinstance(media, str):
+            media = json.loads(media)
+        results = [self._record_send(token, "sendMediaGroup", params) for _ in media]
+        return self._ok(results)
+
+    async def api_exportChatInviteLink(self, token: str, params: dict) -> web.Response:
+        return self._ok(f"https://t.me/+fake{uuid.uuid4().hex[:12]}")
+
+    async def api_createChatInviteLink(self, token: str, params: dict) -> web.Response:
+        return self._ok({
+            "invite_link": f"https://t.me/+fake{uuid.uuid4().hex[:12]}",
+            "creator": {"id": 1, "is_bot": True, "first_name": "fake"},
+            "creates_join_request": False, "is_primary": False, "is_revoked": False,
+            "name": params.get("name"),
+        })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Share of sends answered with 429")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of calls answered with 500")
+    args = parser.parse_args()
+
+    api = FakeBotApi(FaultConfig(
+        latency=args.latency, jitter=args.jitter,
+        retry_after_rate=args.retry_after_rate, failure_rate=args.failure_rate,
+    ))
+    web.run_app(api.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
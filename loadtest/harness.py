@@ -0,0 +1,321 @@
+"""
+End-to-end load harness for ArgBot and ArgManagerBot.
+
+Starts loadtest/fake_bot_api.py in-process, launches runners.run_arg and
+runners.run_manager (and optionally render workers) as subprocesses pointed at it
+and at a local Redis, then replays synthetic traffic:
+
+* /arg: photo messages captioned "/arg" spread over many chats at a fixed rate;
+  latency is measured from queuing the update to receiving the reply photo.
+* broadcast: a channel post to the manager, fanned out by ArgBot to every chat.
+
+Usage:
+    python loadtest/harness.py --redis-url redis://localhost:6379/15 --flush-redis \\
+        --arg-requests 500 --arg-rate 50 --broadcast-chats 2000 --output report.json
+
+--flush-redis empties the given Redis database first; only use it with a scratch database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_bot_api import FakeBotApi, FaultConfig  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARG_TOKEN = "1001:arg-load-test"
+MANAGER_TOKEN = "1002:manager-load-test"
+SOURCE_CHANNEL_ID = -1000000000001
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(samples),
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "max_ms": ordered[-1] * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+    }
+
+
+def make_photo(width: int, height: int) -> bytes:
+    image = Image.merge("RGB", [Image.effect_noise((width, height), sigma) for sigma in (40, 60, 80)])
+    output = BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeBotApi(FaultConfig(
+            latency=args.latency, jitter=args.jitter,
+            retry_after_rate=args.retry_after_rate, failure_rate=args.failure_rate,
+        ))
+        self.processes = []
+        self.log_dir = args.log_dir or tempfile.mkdtemp(prefix="argbot-load-")
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.args.port}"
+
+    def runner_env(self) -> dict:
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.path.join(ROOT, "src"),
+            "TELEGRAM_API_URL": f"{self.base_url}/bot",
+            "TELEGRAM_FILE_URL": f"{self.base_url}/file/bot",
+            "REDIS_URL": self.args.redis_url,
+            "ARG_BOT_TOKEN": ARG_TOKEN,
+            "MANAGER_BOT_TOKEN": MANAGER_TOKEN,
+            "MANAGER_PASSWORD": "load-test",
+            "SOURCE_CHANNEL_ID": str(SOURCE_CHANNEL_ID),
+        }
+        if self.args.render_workers:
+            env["ARG_RENDER_MODE"] = "queue"
+        return env
+
+    async def start_runner(self, module: str, name: str, **extra_env) -> None:
+        log = open(os.path.join(self.log_dir, f"{name}.log"), "w")
+        env = {**self.runner_env(), **extra_env}
+        if self.args.metrics_port:
+            env["METRICS_PORT"] = str(self.args.metrics_port + len(self.processes))
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", module, cwd=ROOT, env=env, stdout=log, stderr=log,
+        )
+        self.processes.append((name, process, log))
+
+    async def scrape_metrics(self) -> dict:
+        """
+        Fetch every runner's /metrics page (see src/telemetry) into the log directory.
+        """
+        import aiohttp
+
+        paths = {}
+        async with aiohttp.ClientSession() as session:
+            for index, (name, _, _) in enumerate(self.processes):
+                url = f"http://127.0.0.1:{self.args.metrics_port + index}/metrics"
+                try:
+                    async with session.get(url) as response:
+                        body = await response.text()
+                except aiohttp.ClientError as e:
+                    print(f"Could not scrape {name} metrics: {e}")
+                    continue
+                paths[name] = os.path.join(self.log_dir, f"{name}.metrics")
+                with open(paths[name], "w") as f:
+                    f.write(body)
+        return paths
+
+    async def stop_runners(self) -> None:
+        for _, process, _ in self.processes:
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+        for name, process, log in self.processes:
+            try:
+                await asyncio.wait_for(process.wait(), 15)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+            log.close()
+
+    async def wait_until(self, predicate, timeout: float, what: str) -> bool:
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            for name, process, _ in self.processes:
+                if process.returncode is not None:
+                    raise RuntimeError(f"{name} exited with {process.returncode}, see {self.log_dir}/{name}.log")
+            if time.monotonic() > deadline:
+                print(f"Timed out waiting for {what}")
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def prepare_redis(self) -> None:
+        import redis.asyncio as redis
+
+        client = redis.Redis.from_url(self.args.redis_url, decode_responses=True)
+        try:
+            if self.args.flush_redis:
+                await client.flushdb()
+            chat_ids = [-(2 * 10 ** 12) - i for i in range(self.args.broadcast_chats)]
+            for start in range(0, len(chat_ids), 1000):
+                await client.sadd("chat_ids", *chat_ids[start:start + 1000])
+        finally:
+            await client.aclose()
+
+    async def run_arg_scenario(self) -> dict:
+        args = self.args
+        photos = [make_photo(*size) for size in [(1280, 960), (960, 1280), (1280, 720)]]
+        injected = {}
+        latencies = []
+
+        def on_sent(sent):
+            if sent.token != ARG_TOKEN or sent.method != "sendPhoto":
+                return
+            started = injected.pop((sent.chat_id, sent.reply_to_message_id), None)
+            if started is not None:
+                latencies.append(sent.received_at - started)
+
+        self.api.on_sent.append(on_sent)
+        started = time.perf_counter()
+        for i in range(args.arg_requests):
+            chat_id = -(10 ** 12) - random.randrange(args.arg_chats)
+            message_id = self.api.next_message_id()
+            data = random.choice(photos)
+            # a fresh file_id per request defeats the result cache unless --repeat-photos is set
+            file_id = self.api.add_file(data, f"photo-{i % 3 if args.repeat_photos else i}")
+            injected[(chat_id, message_id)] = time.perf_counter()
+            self.api.push_update(ARG_TOKEN, {"message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"load chat {chat_id}"},
+                "from": {"id": random.randrange(1, 10 ** 6), "is_bot": False, "first_name": "load"},
+                "photo": [{"file_id": file_id, "file_unique_id": f"u-{file_id}", "width": 1280, "height": 960}],
+                "caption": "/arg",
+                "caption_entities": [{"type": "bot_command", "offset": 0, "length": 4}],
+            }})
+            await asyncio.sleep(1 / args.arg_rate)
+
+        await self.wait_until(lambda: not injected, args.timeout, "/arg replies")
+        duration = time.perf_counter() - started
+        self.api.on_sent.remove(on_sent)
+        return {
+            "requests": args.arg_requests,
+            "replied": len(latencies),
+            "lost": len(injected),
+            "duration_s": duration,
+            "replies_per_s": len(latencies) / duration if duration else 0.0,
+            "latency": percentiles(latencies),
+        }
+
+    async def run_broadcast_scenario(self) -> dict:
+        args = self.args
+        sends = []
+        delivered = {}
+
+        def on_sent(sent):
+            if sent.token == ARG_TOKEN and sent.method.startswith("forward"):
+                sends.append(sent.received_at)
+                delivered[sent.chat_id] = delivered.get(sent.chat_id, 0) + 1
+
+        self.api.on_sent.append(on_sent)
+        started = time.perf_counter()
+        post = {
+            "date": int(time.time()),
+            "chat": {"id": SOURCE_CHANNEL_ID, "type": "channel", "title": "load source"},
+        }
+        if args.broadcast_album > 1:
+            # an album is one channel post per item sharing a media_group_id
+            file_id = self.api.add_file(make_photo(64, 64), "album-photo")
+            for _ in range(args.broadcast_album):
+                self.api.push_update(MANAGER_TOKEN, {"channel_post": {
+                    **post, "message_id": self.api.next_message_id(), "media_group_id": "load-album",
+                    "photo": [{"file_id": file_id, "file_unique_id": "u-album-photo", "width": 64, "height": 64}],
+                }})
+        else:
+            self.api.push_update(MANAGER_TOKEN, {"channel_post": {
+                **post, "message_id": self.api.next_message_id(), "text": "load test broadcast",
+            }})
+
+        expected = args.broadcast_chats * args.broadcast_album
+        await self.wait_until(lambda: len(sends) >= expected, args.timeout, "broadcast fan-out")
+        self.api.on_sent.remove(on_sent)
+        fan_out = sends[-1] - sends[0] if len(sends) > 1 else 0.0
+        return {
+            "chats": args.broadcast_chats,
+            "delivered": len(sends),
+            "duplicates": sum(count - args.broadcast_album for count in delivered.values()),
+            "time_to_first_s": sends[0] - started if sends else None,
+            "total_duration_s": sends[-1] - started if sends else None,
+            "messages_per_s": len(sends) / fan_out if fan_out else 0.0,
+        }
+
+    async def run(self) -> dict:
+        runner = web.AppRunner(self.api.app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", self.args.port).start()
+
+        try:
+            await self.prepare_redis()
+            if self.args.arg_replicas == 1:
+                await self.start_runner("runners.run_arg", "arg-bot")
+            else:
+                for i in range(self.args.arg_replicas):
+                    await self.start_runner("runners.run_arg", f"arg-bot-{i}", ARG_REPLICA_ID=f"arg-bot-{i}")
+            await self.start_runner("runners.run_manager", "manager-bot")
+            for i in range(self.args.render_workers):
+                await self.start_runner("runners.run_render_worker", f"render-worker-{i}")
+
+            await self.wait_until(
+                lambda: {ARG_TOKEN, MANAGER_TOKEN} <= self.api.polling_tokens, 60, "bots to start polling"
+            )
+
+            report = {"config": vars(self.args), "logs": self.log_dir}
+            if self.args.arg_requests:
+                report["arg"] = await self.run_arg_scenario()
+            if self.args.broadcast_chats:
+                report["broadcast"] = await self.run_broadcast_scenario()
+            report["fake_api"] = dict(self.api.counters)
+            if self.args.metrics_port:
+                report["metrics"] = await self.scrape_metrics()
+            return report
+        finally:
+            await self.stop_runners()
+            await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--flush-redis", action="store_true", help="FLUSHDB the Redis database before the run")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--arg-requests", type=int, default=200)
+    parser.add_argument("--arg-rate", type=float, default=20.0, help="/arg updates per second")
+    parser.add_argument("--arg-chats", type=int, default=50)
+    parser.add_argument("--repeat-photos", action="store_true", help="Reuse three source photos (result cache hits)")
+    parser.add_argument("--broadcast-chats", type=int, default=1000)
+    parser.add_argument("--broadcast-album", type=int, default=1,
+                        help="Broadcast an album of this many photos instead of a text post")
+    parser.add_argument("--arg-replicas", type=int, default=1,
+                        help="Run this many ArgBot replicas sharing broadcasts (they all poll the fake API)")
+    parser.add_argument("--render-workers", type=int, default=0, help="Run this many render workers (queue mode)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Give the runners METRICS_PORT=N, N+1, ... and save their /metrics pages")
+    parser.add_argument("--log-dir")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(Harness(args).run())
+    print(json.dumps(report, indent=2, default=str))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
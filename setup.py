@@ -10,10 +10,12 @@ setup(
     install_requires=[
         "python-telegram-bot>=22.1",
         "pillow>=11.2.1",
-        "requests>=2.32.4",
         "aiohttp>=3.12.13",
         "redis>=5.0.4",
     ],
+    extras_require={
+        "webhooks": ["python-telegram-bot[webhooks]>=22.1"],
+    },
     package_dir={"": "src"},
     packages=find_packages(where="src"),
 )
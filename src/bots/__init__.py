@@ -1,5 +1,29 @@
 __version__ = "0.1.0"
 
-from .arg_bot import ArgBot
-from .manager_bot import ArgManagerBot
-from .base_bot import BaseBot
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+# Exports are imported on first access so that e.g. the manager runner does not
+# pay for Pillow, aiohttp and the font checks that only ArgBot needs.
+_EXPORTS = {
+    "ArgBot": ".arg_bot",
+    "ArgManagerBot": ".manager_bot",
+    "BaseBot": ".base_bot",
+}
+
+if TYPE_CHECKING:
+    from .arg_bot import ArgBot
+    from .manager_bot import ArgManagerBot
+    from .base_bot import BaseBot
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, NoReturn, Optional, Tuple
+
+from bots.broadcast import TokenBucket
+from telemetry import registry
+
+SHED = registry.counter("arg_admission_shed_total", "/arg requests shed by admission control.", ("reason",))
+COALESCED = registry.counter("arg_admission_coalesced_total", "/arg requests served by another in-flight render.")
+WAIT_SECONDS = registry.histogram("arg_admission_wait_seconds", "Time an /arg request waited for pixel budget.")
+
+
+class AdmissionRejected(RuntimeError):
+    """
+    Raised when an /arg request is shed. `reason` is one of AdmissionController.REASONS.
+    """
+
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Sits in front of ArgBot.process_arg and decides whether a request may start:
+
+    * per-chat and per-user token buckets shed spam before anything is downloaded;
+    * a pixel budget bounds the decoded bitmaps held at once (a 10 MP RGB photo
+      is ~30 MB), requests wait for budget up to `max_wait` seconds and at most
+      `max_queue` of them wait at all;
+    * identical photos (same file_unique_id) rendered concurrently are coalesced
+      onto the first request's result.
+    """
+
+    REASONS = ("chat_rate", "user_rate", "busy")
+
+    def __init__(
+        self,
+        pixel_budget: int = 48_000_000,
+        max_wait: float = 10.0,
+        max_queue: int = 64,
+        chat_rate: float = 0.5,
+        chat_burst: float = 5,
+        user_rate: float = 0.2,
+        user_burst: float = 3,
+        notice_interval: float = 30.0,
+    ):
+        self.pixel_budget = pixel_budget
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.user_rate, self.user_burst = user_rate, user_burst
+        self.notice_interval = notice_interval
+
+        self._pixels_in_use = 0
+        self._waiting = 0
+        self._budget_changed = asyncio.Condition()
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._user_buckets: Dict[int, TokenBucket] = {}
+        self._last_notice: Dict[int, float] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """
+        Build a controller from ARG_ADMISSION_PIXEL_BUDGET, ARG_ADMISSION_MAX_WAIT,
+        ARG_ADMISSION_MAX_QUEUE, ARG_ADMISSION_CHAT_RATE/_BURST and
+        ARG_ADMISSION_USER_RATE/_BURST (requests per second).
+        """
+        return cls(
+            pixel_budget=int(os.getenv("ARG_ADMISSION_PIXEL_BUDGET", "48000000")),
+            max_wait=float(os.getenv("ARG_ADMISSION_MAX_WAIT", "10")),
+            max_queue=int(os.getenv("ARG_ADMISSION_MAX_QUEUE", "64")),
+            chat_rate=float(os.getenv("ARG_ADMISSION_CHAT_RATE", "0.5")),
+            chat_burst=float(os.getenv("ARG_ADMISSION_CHAT_BURST", "5")),
+            user_rate=float(os.getenv("ARG_ADMISSION_USER_RATE", "0.2")),
+            user_burst=float(os.getenv("ARG_ADMISSION_USER_BURST", "3")),
+        )
+
+    @property
+    def pixels_in_use(self) -> int:
+        return self._pixels_in_use
+
+    @staticmethod
+    def _bucket(buckets: Dict[int, TokenBucket], key: int, rate: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) > 10_000:
+                # forget everyone whose bucket has refilled; they are back to a fresh one anyway
+                for stale in [k for k, b in buckets.items() if b.full]:
+                    del buckets[stale]
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def check_rate(self, chat_id: int, user_id: Optional[int]) -> None:
+        """
+        Take one token from the chat's and the user's bucket. Both are checked before
+        either is charged, so a request shed for one bucket does not drain the other.
+
+        :raises AdmissionRejected: With reason "chat_rate" or "user_rate".
+        """
+        chat_bucket = user_bucket = None
+        if self.chat_rate > 0:
+            chat_bucket = self._bucket(self._chat_buckets, chat_id, self.chat_rate, self.chat_burst)
+            if not chat_bucket.can_acquire():
+                self.shed("chat_rate")
+        if user_id is not None and self.user_rate > 0:
+            user_bucket = self._bucket(self._user_buckets, user_id, self.user_rate, self.user_burst)
+            if not user_bucket.can_acquire():
+                self.shed("user_rate")
+        for bucket in (chat_bucket, user_bucket):
+            if bucket is not None:
+                bucket.try_acquire()
+
+    def shed(self, reason: str) -> NoReturn:
+        SHED.inc(reason=reason)
+        raise AdmissionRejected(reason)
+
+    def should_notify(self, chat_id: int) -> bool:
+        """
+        Whether a shed request in this chat should get a polite reply. At most one
+        notice per `notice_interval`, so that a spammed chat does not get a spammed answer.
+        """
+        now = time.monotonic()
+        if now - self._last_notice.get(chat_id, float("-inf")) < self.notice_interval:
+            return False
+        if len(self._last_notice) > 10_000:
+            self._last_notice = {k: t for k, t in self._last_notice.items() if now - t < self.notice_interval}
+        self._last_notice[chat_id] = now
+        return True
+
+    @asynccontextmanager
+    async def pixels(self, count: int):
+        """
+        Hold `count` pixels of the render budget for the duration of the block. A
+        photo larger than the whole budget is admitted alone.
+
+        :raises AdmissionRejected: With reason "busy" if the wait queue is full or
+            the budget did not free up within `max_wait` seconds.
+        """
+        count = min(count, self.pixel_budget)
+        started = time.perf_counter()
+        async with self._budget_changed:
+            if self._pixels_in_use + count > self.pixel_budget:
+                if self._waiting >= self.max_queue:
+                    self.shed("busy")
+                self._waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self._budget_changed.wait_for(lambda: self._pixels_in_use + count <= self.pixel_budget),
+                        self.max_wait,
+                    )
+                except asyncio.TimeoutError:
+                    self.shed("busy")
+                finally:
+                    self._waiting -= 1
+            self._pixels_in_use += count
+        WAIT_SECONDS.observe(time.perf_counter() - started)
+
+        try:
+            yield
+        finally:
+            async with self._budget_changed:
+                self._pixels_in_use -= count
+                self._budget_changed.notify_all()
+
+    async def coalesce(self, key: str, render: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run `render()` unless a render for `key` is already in flight, in which case
+        wait for that one instead. Waiters get None if the first render fails.
+
+        :return: The render result and whether this call ran it (False when coalesced).
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            COALESCED.inc()
+            return await asyncio.shield(inflight), False
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        result = None
+        try:
+            result = await render()
+            return result, True
+        finally:
+            del self._inflight[key]
+            future.set_result(result)
@@ -1,39 +1,98 @@
 import os
+import time
 import asyncio
-import requests
+import aiohttp
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
-from telegram import Update, InputFile, Bot
+from PIL import Image
+from telegram import (
+    Update, InputFile, Bot, Message, PhotoSize,
+    InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo,
+)
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from bots.base_bot import BaseBot
-from typing import Dict, Any
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-FONT_SHARP_PATH = os.path.join(BASE_DIR, "..", "assets", "1.otf")
-FONT_ARG_PATH = os.path.join(BASE_DIR, "..", "assets", "2.ttf")
-
-for font_path in [FONT_SHARP_PATH, FONT_ARG_PATH]:
-    if not os.path.exists(font_path):
-        raise FileNotFoundError(f"Missing font file: {font_path}")
+from bots.admission import AdmissionController, AdmissionRejected
+from bots.rendering import font_cache, draw_arg_on_image
+from bots.render_pool import RenderPool, RenderPoolOverloaded
+from bots.sharding import ReplicaMembership
+from bots.broadcast import BroadcastSender
+from bots.invite_links import InviteLinkCache
+from redis_helper.chat_registry import ChatRegistry
+from redis_helper.metrics_writer import MetricsWriter
+from telemetry import registry
+from typing import Any, AsyncGenerator, Dict
+
+ARG_STAGE_SECONDS = registry.histogram(
+    "arg_request_stage_seconds", "Time spent in each network stage of an /arg request.", ("stage",)
+)
+ARG_REQUESTS = registry.counter("arg_requests_total", "Handled /arg requests by outcome.", ("outcome",))
+ADMISSION_REPLIES = {
+    "chat_rate": "В этом чате слишком много /arg подряд, подожди немного.",
+    "user_rate": "Ты слишком часто отправляешь /arg, подожди немного.",
+    "busy": "Слишком много фотографий в обработке, попробуй чуть позже.",
+}
+BROADCAST_COMPOSE_SECONDS = registry.histogram(
+    "broadcast_compose_seconds", "Time to prepare a broadcast before fanning it out."
+)
+# message field -> InputMedia class, for re-sending an album item by file_id
+ALBUM_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
 
 class ArgBot(BaseBot):
     def __init__(self, logger, redis_helper):
         super().__init__(logger, redis_helper)
         self._bg_task = None
+        self._rebalance_task = None
+        self._rebalance_requested = False
+        self._http = None
+        self.membership = ReplicaMembership.from_env(redis_helper)
+        self.replica_id = self.membership.replica_id
+        # one broadcast pass at a time, so that a rebalance never races the main loop
+        self._broadcast_lock = asyncio.Lock()
+        self.target_resolution = int(os.getenv("ARG_TARGET_RESOLUTION", "1280"))
+        self.result_cache_ttl = int(os.getenv("ARG_RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+        self.render_mode = os.getenv("ARG_RENDER_MODE", "local").lower()
+        self.render_pool = RenderPool.from_env()
+        self.admission = AdmissionController.from_env()
+        self.sender = BroadcastSender.from_env()
+        self.metrics_writer = MetricsWriter.from_env(redis_helper)
+        self.chat_registry = ChatRegistry.from_env(redis_helper)
+        self.invite_links = InviteLinkCache.from_env(redis_helper)
 
     def register_handlers(self, app: Application):
         app.add_handler(CommandHandler("start", self.handle_start))
         app.add_handler(CommandHandler("arg", self.arg_command))
         app.add_handler(MessageHandler(filters.PHOTO & filters.CaptionRegex(r"(?i)/arg"), self.photo_with_arg))
         app.post_init = self.on_startup
+        app.post_shutdown = self.on_shutdown
 
     async def on_startup(self, app: Application):
         self._bg_task = asyncio.create_task(self._broadcast_loop(app.bot))
-        self.logger.info("Broadcast loop started.")
+        self.membership.start(lambda: self._schedule_rebalance(app.bot))
+        self.metrics_writer.start()
+        self.logger.info(f"Broadcast loop started as replica {self.replica_id}.")
+
+    async def on_shutdown(self, app: Application):
+        # wait for the cancelled loops to unwind before their Redis connections are closed
+        tasks = [task for task in (self._bg_task, self._rebalance_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.membership.stop()
+        self.render_pool.shutdown()
+        await self.metrics_writer.stop()
+        if self._http is not None:
+            await self._http.close()
+        await self.redis.close()
 
     async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
-        self.redis.add_chat_id(chat_id)
+        if await self.redis.add_chat_id(chat_id):
+            self.chat_registry.add(chat_id)
         await update.message.reply_text(
             "Пришли фото с подписью /arg или ответь командой /arg на сообщение с фото — и я наложу надпись '#arg'."
         )
@@ -50,87 +109,180 @@ class ArgBot(BaseBot):
 
     async def process_arg(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message):
         if not message.photo:
+            ARG_REQUESTS.inc(outcome="no_photo")
             await update.message.reply_text("Сообщение должно содержать фотографию.")
             return
 
-        photo = message.photo[-1]
-        telegram_file = await context.bot.get_file(photo.file_id)
-
-        output = BytesIO()
-        await telegram_file.download_to_memory(out=output)
-        output.seek(0)
-        image = Image.open(output).convert("RGB")
-
-        result = self.draw_arg_on_image(image)
-        await update.message.reply_photo(photo=InputFile(result, filename="result.jpg"));
-        self.logger.info("Отправлено изображение с текстом")
+        started = time.perf_counter()
+        photo = self.select_photo_size(message.photo)
+        try:
+            user = update.effective_user
+            self.admission.check_rate(update.effective_chat.id, user.id if user else None)
+            if await self.reply_from_result_cache(update, photo):
+                ARG_REQUESTS.inc(outcome="cached")
+            elif self.render_mode == "queue":
+                await self.enqueue_render(update, photo)
+                ARG_REQUESTS.inc(outcome="queued")
+            else:
+                await self.render_coalesced(update, context, photo)
+        except AdmissionRejected as e:
+            ARG_REQUESTS.inc(outcome="rejected")
+            await self.reject_arg(update, e)
+            return
+        ARG_STAGE_SECONDS.observe(time.perf_counter() - started, stage="reply")
 
         chat = update.effective_chat.to_dict()
 
-        self.logger.info(f"Saving metrics for chat {chat['id']}")
+        # Invite links come from the Redis cache; missing ones are generated in the background
+        invite_link = await self.invite_links.get(context.bot, chat)
+
+        # Buffer the increment; MetricsWriter flushes it to Redis in batches
+        if invite_link:
+            chat["invite_link"] = invite_link
+        self.metrics_writer.add(chat, user_id=user.id if user else None)
 
-        # Try to generate an invite link (requires bot to be admin in the chat)
-        invite_link = None
+    async def reject_arg(self, update: Update, rejection: AdmissionRejected) -> None:
+        """
+        Answer a shed /arg politely, at most once per AdmissionController.notice_interval per chat.
+        """
+        chat_id = update.effective_chat.id
+        self.logger.warning(f"Shed /arg in chat {chat_id}: {rejection}")
         try:
-            invite_link = await context.bot.export_chat_invite_link(chat['id'])
-            self.logger.info(f"Generated invite link for chat {chat['id']}: {invite_link}")
+            await self.redis.record_admission_shed(rejection.reason)
         except Exception as e:
-            self.logger.warning(f"Could not generate invite link for chat {chat['id']}: {e}")
+            self.logger.warning(f"Could not record shed /arg: {e}")
+
+        if self.admission.should_notify(chat_id):
+            await update.message.reply_text(ADMISSION_REPLIES.get(rejection.reason, ADMISSION_REPLIES["busy"]))
+
+    async def render_coalesced(self, update: Update, context: ContextTypes.DEFAULT_TYPE, photo: PhotoSize) -> None:
+        """
+        Render the photo, or, if the same photo is already being rendered for another
+        request, wait for that render and reply with its result.
+        """
+        key = f"{self.result_version}:{photo.file_unique_id}"
+        file_id, rendered = await self.admission.coalesce(key, lambda: self.render_and_reply(update, context, photo))
+        if rendered:
+            ARG_REQUESTS.inc(outcome="rendered")
+        elif file_id:
+            await update.message.reply_photo(photo=file_id)
+            ARG_REQUESTS.inc(outcome="coalesced")
+        else:
+            # the render we waited for failed, try once more on our own
+            await self.render_and_reply(update, context, photo)
+            ARG_REQUESTS.inc(outcome="rendered")
+
+    async def render_and_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE, photo: PhotoSize) -> str:
+        """
+        Download, stamp and send the photo from this process. The download and the
+        decoded bitmap count against the admission pixel budget.
+
+        :return: file_id of the sent photo.
+        :raises AdmissionRejected: If there is no pixel budget or the render pool is full.
+        """
+        async with self.admission.pixels(photo.width * photo.height):
+            with ARG_STAGE_SECONDS.time(stage="download"):
+                telegram_file = await context.bot.get_file(photo.file_id)
+                data = await telegram_file.download_as_bytearray()
+
+            try:
+                result = await self.render_pool.render(bytes(data), self.target_resolution)
+            except RenderPoolOverloaded:
+                self.admission.shed("busy")
 
-        # Save or increment metrics for the chat
+        with ARG_STAGE_SECONDS.time(stage="upload"):
+            sent = await update.message.reply_photo(photo=InputFile(result, filename="result.jpg"))
+        self.logger.info("Отправлено изображение с текстом")
+        await self.store_result(photo, sent)
+        return sent.photo[-1].file_id
+
+    async def enqueue_render(self, update: Update, photo: PhotoSize) -> None:
+        """
+        Hand the photo to the render workers; see runners/run_render_worker.py.
+        """
+        entry_id = await self.redis.enqueue_render_job({
+            "file_id": photo.file_id,
+            "file_unique_id": photo.file_unique_id,
+            "chat_id": update.effective_chat.id,
+            "reply_to_message_id": update.message.message_id,
+            "target_resolution": self.target_resolution,
+        })
+        self.logger.info(f"Queued render job {entry_id} for chat {update.effective_chat.id}")
+
+    @property
+    def result_version(self) -> str:
+        return self.render_pool.result_version(self.target_resolution)
+
+    async def reply_from_result_cache(self, update: Update, photo: PhotoSize) -> bool:
+        """
+        Reply with an already rendered copy of the photo, if there is one.
+
+        :return: True if the cached copy was sent.
+        """
         try:
-            if invite_link:
-                chat["invite_link"] = invite_link
+            with ARG_STAGE_SECONDS.time(stage="cache_lookup"):
+                file_id = await self.redis.get_cached_result(photo.file_unique_id, self.result_version)
+        except Exception as e:
+            self.logger.warning(f"Result cache lookup failed: {e}")
+            return False
+        if not file_id:
+            return False
 
-            self.redis.save_or_increment_metric(chat)
-            self.logger.info(f"Метрики обновлены для чата {chat.get('title') or chat.get('username') or chat['id']}")
+        try:
+            await update.message.reply_photo(photo=file_id)
+        except BadRequest as e:
+            self.logger.warning(f"Cached result {file_id} is no longer valid: {e}")
+            return False
+        self.logger.info(f"Отправлено изображение из кэша ({photo.file_unique_id})")
+        return True
+
+    async def store_result(self, photo: PhotoSize, sent: Message) -> None:
+        try:
+            await self.redis.cache_result(
+                photo.file_unique_id, self.result_version, sent.photo[-1].file_id, self.result_cache_ttl
+            )
         except Exception as e:
-            self.logger.error(f"Ошибка сохранения метрик: {e}")
+            self.logger.warning(f"Could not cache rendered result: {e}")
+
+    def select_photo_size(self, photos) -> PhotoSize:
+        """
+        Pick the smallest PhotoSize whose longest side reaches the target resolution,
+        or the largest one if none does. Telegram lists sizes in ascending order.
+        """
+        for photo in photos:
+            if max(photo.width, photo.height) >= self.target_resolution:
+                return photo
+        return photos[-1]
 
     def draw_arg_on_image(self, image: Image.Image) -> BytesIO:
-        draw = ImageDraw.Draw(image)
-        font_sharp, font_arg = self.fit_fonts(draw, image.width, image.height)
-
-        text_sharp = "#"
-        text_arg = "arg"
-        spacing = 10
-
-        width_sharp = draw.textlength(text_sharp, font=font_sharp)
-        width_arg = draw.textlength(text_arg, font=font_arg)
-        height = max(font_sharp.getbbox(text_sharp)[3], font_arg.getbbox(text_arg)[3])
-
-        total_width = width_sharp + width_arg + spacing
-        x = (image.width - total_width) // 2
-        y = image.height - height - 20
-
-        def draw_with_shadow(draw_fn, pos, font, text, fill="white"):
-            for dx, dy in [(-1, -1), (1, -1), (-1, 1), (1, 1)]:
-                draw_fn((pos[0] + dx, pos[1] + dy), text, font=font, fill="black")
-            draw_fn(pos, text, font=font, fill=fill)
-
-        draw_with_shadow(draw.text, (x, y), font_sharp, text_sharp)
-        draw_with_shadow(draw.text, (x + width_sharp + spacing, y), font_arg, text_arg)
-
-        result = BytesIO()
-        result.name = "result.jpg"
-        image.save(result, "JPEG")
-        result.seek(0)
-        return result
+        return draw_arg_on_image(image, self.render_pool.encode_settings)
 
     def fit_fonts(self, draw, image_width, image_height):
-        base_size = int(image_height * 0.05)
-        for size in range(base_size, 10, -1):
-            font_sharp = ImageFont.truetype(str(FONT_SHARP_PATH), size)
-            font_arg = ImageFont.truetype(str(FONT_ARG_PATH), size)
-            width_sharp = draw.textlength("#", font=font_sharp)
-            width_arg = draw.textlength("arg", font=font_arg)
-            total_width = width_sharp + width_arg + 10
-            if total_width <= image_width * 0.95:
-                return font_sharp, font_arg
-        return ImageFont.truetype(str(FONT_SHARP_PATH), 12), ImageFont.truetype(str(FONT_ARG_PATH), 12)
+        layout = font_cache.fit(image_width, image_height)
+        return layout.font_sharp, layout.font_arg
 
     async def compose_send_instruction(self, bot: Bot, msg: dict, caption: str, parse_mode: str):
-        if "photo" in msg:
+        if msg.get("content_type") == "forward_from_channel":
+            # entries published before albums were batched carry a single message_id
+            message_ids = msg.get("message_ids") or [msg["message_id"]]
+            if len(message_ids) == 1:
+                return {
+                    "send_method": bot.forward_message,
+                    "send_args": {
+                        "from_chat_id": msg["from_chat_id"],
+                        "message_id": message_ids[0],
+                    }
+                }
+            return {
+                "send_method": bot.forward_messages,
+                "send_args": {
+                    "from_chat_id": msg["from_chat_id"],
+                    "message_ids": message_ids,
+                }
+            }
+        elif msg.get("content_type") == "media_group":
+            return self.compose_media_group_instruction(bot, msg["messages"], parse_mode)
+        elif "photo" in msg:
             return {
                 "send_method": bot.send_photo,
                 "send_args": {
@@ -172,82 +324,93 @@ class ArgBot(BaseBot):
                     "parse_mode": parse_mode,
                 }
             }
-        elif msg.get("content_type") == "forward_from_channel":
-          from_chat_id = msg["from_chat_id"]
-          msg_id = msg["message_id"]
-          chat_ids = self.redis.get_all_chat_ids()
-          for chat_id in chat_ids:
-              try:
-                  await bot.forward_message(
-                      chat_id=chat_id,
-                      from_chat_id=from_chat_id,
-                      message_id=msg_id
-                  )
-                  self.logger.info(f"Forwarded channel message {msg_id} to {chat_id}")
-              except Exception as e:
-                  self.logger.warning(f"Failed to forward to {chat_id}: {e}")
-          return None
-
-        # elif ctype == "forward_from_channel":
-        #     from_chat_id = item["from_chat_id"]
-        #     msg_id = item["message_id"]
-        #     chat_ids = self.redis.get_all_chat_ids()
-
-        #     for chat_id in chat_ids:
-        #         try:
-        #             await bot.forward_message(
-        #                 chat_id=chat_id,
-        #                 from_chat_id=from_chat_id,
-        #                 message_id=msg_id
-        #             )
-        #             self.logger.info(f"Forwarded channel message {msg_id} to {chat_id}")
-        #         except Exception as e:
-        #             self.logger.warning(f"Failed to forward to {chat_id}: {e}")
         elif "audio" in msg:
-            # AUDIO MUST use requests due to 'thumb' requirement
+            # AUDIO is uploaded through aiohttp once, see compose_audio_instruction
             return await self.compose_audio_instruction(bot, msg["audio"], caption, parse_mode)
         else:
             raise ValueError(f"Unsupported message type: {msg}")
 
+    def compose_media_group_instruction(self, bot: Bot, messages: list, parse_mode: str) -> Dict[str, Any]:
+        """
+        Re-send an album with one sendMediaGroup per chat instead of one message per item.
+        """
+        media = []
+        for item in messages:
+            field = next((field for field in ALBUM_MEDIA if field in item), None)
+            if field is None:
+                raise ValueError(f"Unsupported album item: {item}")
+            file_id = item["photo"][-1]["file_id"] if field == "photo" else item[field]["file_id"]
+            media.append(ALBUM_MEDIA[field](media=file_id, caption=item.get("caption"), parse_mode=parse_mode))
+
+        return {
+            "send_method": bot.send_media_group,
+            "send_args": {"media": media}
+        }
+
+    async def _get_http_session(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession()
+        return self._http
+
+    async def _upload_audio(self, bot: Bot, chat_id: int, audio_bytes: bytes, thumb_bytes, fields: dict) -> dict:
+        """
+        Upload the audio (and thumbnail) with sendAudio and return the sent Message as a dict.
+        """
+        form = aiohttp.FormData()
+        form.add_field("chat_id", str(chat_id))
+        for key, value in fields.items():
+            form.add_field(key, str(value))
+        form.add_field("audio", audio_bytes, filename="audio.mp3")
+        if thumb_bytes:
+            form.add_field("thumbnail", thumb_bytes, filename="thumb.jpg")
+
+        session = await self._get_http_session()
+        async with session.post(f"{bot.base_url}/sendAudio", data=form) as response:
+            payload = await response.json(content_type=None)
+
+        if not payload.get("ok"):
+            retry_after = payload.get("parameters", {}).get("retry_after")
+            if retry_after:
+                raise RetryAfter(retry_after)
+            raise RuntimeError(f"Telegram error: {payload.get('description')}")
+        return payload["result"]
+
     async def compose_audio_instruction(self, bot: Bot, audio: dict, caption: str, parse_mode: str) -> Dict[str, Any]:
         file_id = audio["file_id"]
-        title = audio.get("title")
-        performer = audio.get("performer")
-        duration = audio.get("duration")
-        thumb_id = audio.get("thumb", {}).get("file_id")
+        thumb = audio.get("thumbnail") or audio.get("thumb") or {}
+        thumb_id = thumb.get("file_id")
+        fields = {
+            "caption": caption,
+            "parse_mode": parse_mode,
+            "title": audio.get("title"),
+            "performer": audio.get("performer"),
+            "duration": audio.get("duration"),
+        }
+        fields = {k: v for k, v in fields.items() if v is not None}
 
-        # ⬇️ Download ONCE
+        # Download ONCE
         audio_file = await bot.get_file(file_id)
-        audio_bytes = await audio_file.download_as_bytearray()
+        audio_bytes = bytes(await audio_file.download_as_bytearray())
 
         thumb_bytes = None
         if thumb_id:
             thumb_file = await bot.get_file(thumb_id)
-            thumb_bytes = await thumb_file.download_as_bytearray()
-
-        # ✅ Create reusable send method
-        def send_audio_to(chat_id: int):
-            files = {
-                "audio": ("audio.mp3", BytesIO(audio_bytes)),
-            }
-            if thumb_bytes:
-                files["thumb"] = ("thumb.jpg", BytesIO(thumb_bytes))
-
-            data = {
-                "chat_id": chat_id,
-                "caption": caption,
-                "parse_mode": parse_mode,
-                "title": title,
-                "performer": performer,
-                "duration": duration
-            }
-            data = {k: v for k, v in data.items() if v is not None}
-
-            url = f"https://api.telegram.org/bot{bot.token}/sendAudio"
-            response = requests.post(url, data=data, files=files)
-
-            if not response.ok:
-                raise RuntimeError(f"Telegram error: {response.text}")
+            thumb_bytes = bytes(await thumb_file.download_as_bytearray())
+
+        # Upload ONCE: the first successful send returns a file_id that every other chat reuses
+        uploaded_file_id = None
+        upload_lock = asyncio.Lock()
+
+        async def send_audio_to(chat_id: int):
+            nonlocal uploaded_file_id
+            if uploaded_file_id is None:
+                async with upload_lock:
+                    if uploaded_file_id is None:
+                        sent = await self._upload_audio(bot, chat_id, audio_bytes, thumb_bytes, fields)
+                        uploaded_file_id = sent["audio"]["file_id"]
+                        self.logger.info(f"Uploaded broadcast audio ({len(audio_bytes)} bytes), file_id={uploaded_file_id}")
+                        return
+            await bot.send_audio(chat_id=chat_id, audio=uploaded_file_id, **fields)
 
         return {
             "send_method": send_audio_to,
@@ -256,28 +419,91 @@ class ArgBot(BaseBot):
 
 
     async def _broadcast_loop(self, bot: Bot):
-        async for item in self.redis.subscribe_to_broadcasts():
+        while True:
             try:
-                if item.get("content_type") != "message_dict":
-                    self.logger.warning("Unsupported content_type.")
-                    continue
+                await self._consume_broadcasts(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Broadcast stream error, reconnecting in 5s: {e}")
+                await asyncio.sleep(5)
 
-                msg = item["message"]
-                chat_ids = self.redis.get_all_chat_ids()
-                caption = msg.get("caption", "")
-                parse_mode = "HTML"
+    async def _consume_broadcasts(self, bot: Bot):
+        # join the ring before reading; running broadcasts older than the watermark
+        # this replica's group starts from are picked up by the rebalance
+        if not self.membership.ring.replicas and await self.membership.refresh():
+            self._schedule_rebalance(bot)
 
-                try:
+        async for entry_id, item in self.redis.consume_broadcasts(self.replica_id):
+            try:
+                if not item or item.get("content_type") != "message_dict":
+                    self.logger.warning(f"Unsupported broadcast {entry_id}, skipping.")
+                elif not await self.redis.start_broadcast(entry_id):
+                    self.logger.info(f"Broadcast {entry_id} was already finished, skipping.")
+                else:
+                    await self._serve_broadcast(bot, entry_id, item["message"])
+                await self.redis.ack_broadcast(entry_id, self.replica_id)
+            except Exception as e:
+                self.logger.error(f"Broadcast loop error: {e}")
+
+    def _schedule_rebalance(self, bot: Bot) -> None:
+        """
+        Called when replicas join or leave: serve this replica's share of every
+        running broadcast under the new membership. Requests arriving during a
+        rebalance run it once more afterwards.
+        """
+        self._rebalance_requested = True
+        if self._rebalance_task is None or self._rebalance_task.done():
+            self._rebalance_task = asyncio.create_task(self._rebalance(bot))
+
+    async def _rebalance(self, bot: Bot) -> None:
+        while self._rebalance_requested:
+            self._rebalance_requested = False
+            try:
+                for entry_id, item in await self.redis.get_active_broadcasts():
+                    if item.get("content_type") == "message_dict":
+                        await self._serve_broadcast(bot, entry_id, item["message"])
+            except Exception as e:
+                self.logger.error(f"Broadcast rebalance failed: {e}")
+
+    async def _owned_chat_ids(self, entry_id: str, ring) -> AsyncGenerator[int, None]:
+        """
+        Yield the chats this replica serves for a broadcast: those the ring assigns to
+        it, claimed in Redis batch by batch so that no chat is served twice.
+        """
+        async for batch in self.chat_registry.iter_batches():
+            owned = [chat_id for chat_id in batch if ring.owner(chat_id) == self.replica_id]
+            for chat_id in await self.redis.claim_broadcast_chats(entry_id, self.replica_id, owned, self.membership.ttl):
+                yield chat_id
+
+    async def _serve_broadcast(self, bot: Bot, entry_id: str, msg: dict) -> None:
+        async with self._broadcast_lock:
+            ring = self.membership.ring
+            caption = msg.get("caption", "")
+            parse_mode = "HTML"
+
+            try:
+                with BROADCAST_COMPOSE_SECONDS.time():
                     send_instruction = await self.compose_send_instruction(bot, msg, caption, parse_mode)
-                except Exception as e:
-                    self.logger.error(f"Compose error: {e}")
-                    continue
-
-                for chat_id in chat_ids:
-                    try:
-                        await send_instruction["send_method"](chat_id=chat_id, **send_instruction["send_args"])
-                        self.logger.info(f"Sent message to {chat_id}")
-                    except Exception as e:
-                        self.logger.warning(f"Failed to send to {chat_id}: {e}")
             except Exception as e:
-                self.logger.error(f"Broadcast loop error: {e}")
\ No newline at end of file
+                self.logger.error(f"Compose error: {e}")
+                send_instruction = None
+
+            if send_instruction is not None:
+                async def checkpoint(chat_id: int):
+                    await self.redis.mark_broadcast_sent(entry_id, chat_id)
+
+                stats = await self.sender.send_all(
+                    self._owned_chat_ids(entry_id, ring),
+                    send_instruction["send_method"], send_instruction["send_args"], on_sent=checkpoint,
+                )
+                self.logger.info(
+                    f"Broadcast {entry_id} share of {self.replica_id} (epoch {ring.epoch}, {len(ring.replicas)} replicas): "
+                    f"{stats.sent} sent, {stats.failed} failed in {stats.duration:.2f}s "
+                    f"({stats.messages_per_second:.1f} msg/s)"
+                )
+
+            if await self.redis.finish_broadcast_pass(
+                entry_id, self.replica_id, ring.epoch, list(ring.replicas), self.membership.ttl
+            ):
+                self.logger.info(f"Broadcast {entry_id} finished on all replicas.")
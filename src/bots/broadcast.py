@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+from telegram.error import RetryAfter
+
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = registry.histogram("broadcast_send_seconds", "Bot API latency of one broadcast send.")
+SEND_WAIT_SECONDS = registry.histogram(
+    "broadcast_send_wait_seconds", "Time a broadcast send waited on the rate limiters."
+)
+MESSAGES = registry.counter("broadcast_messages_total", "Broadcast send attempts by result.", ("result",))
+FANOUT_SECONDS = registry.histogram(
+    "broadcast_fanout_seconds", "Wall-clock duration of fanning one broadcast out to all chats.",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+
+# Telegram allows roughly 30 messages per second per bot and about one message
+# per second into the same chat.
+TELEGRAM_GLOBAL_RATE = 30.0
+TELEGRAM_PER_CHAT_INTERVAL = 1.0
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket: `rate` tokens are refilled per second, up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def full(self) -> bool:
+        """
+        Whether the bucket has refilled to capacity, i.e. is indistinguishable from a new one.
+        """
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def can_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Whether `tokens` could be taken right now, without taking them.
+        """
+        self._refill()
+        return self._tokens >= tokens
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Take tokens without waiting. Returns False if the bucket is short.
+        """
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """
+        Wait until `tokens` are available and take them. Waiters are served in order.
+        """
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """
+    Keeps at least `interval` seconds between two sends into the same chat.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_allowed: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        now = time.monotonic()
+        ready_at = self._next_allowed.get(chat_id, now)
+        self._next_allowed[chat_id] = max(ready_at, now) + self.interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    def prune(self) -> None:
+        """
+        Forget chats whose interval has already elapsed so the table stays small.
+        """
+        now = time.monotonic()
+        self._next_allowed = {cid: t for cid, t in self._next_allowed.items() if t > now}
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    failed: int = 0
+    duration: float = 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+
+class BroadcastSender:
+    """
+    Fans a single send instruction out to many chats with a bounded number of
+    requests in flight, a global token bucket and a per-chat limiter.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 20,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        per_chat_interval: float = TELEGRAM_PER_CHAT_INTERVAL,
+        max_retries: int = 3,
+    ):
+        self.concurrency = concurrency
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat = PerChatLimiter(per_chat_interval)
+        self.max_retries = max_retries
+
+    @classmethod
+    def from_env(cls) -> "BroadcastSender":
+        """
+        Build a sender from ARG_BROADCAST_CONCURRENCY, ARG_BROADCAST_RATE and
+        ARG_BROADCAST_PER_CHAT_INTERVAL.
+        """
+        return cls(
+            concurrency=int(os.getenv("ARG_BROADCAST_CONCURRENCY", "20")),
+            global_rate=float(os.getenv("ARG_BROADCAST_RATE", str(TELEGRAM_GLOBAL_RATE))),
+            per_chat_interval=float(os.getenv("ARG_BROADCAST_PER_CHAT_INTERVAL", str(TELEGRAM_PER_CHAT_INTERVAL))),
+        )
+
+    async def _send_one(
+        self,
+        chat_id: int,
+        send_method: Callable[..., Awaitable[Any]],
+        send_args: Dict[str, Any],
+    ) -> bool:
+        for attempt in range(self.max_retries + 1):
+            waited = time.perf_counter()
+            await self.per_chat.wait(chat_id)
+            await self.global_bucket.acquire()
+            started = time.perf_counter()
+            SEND_WAIT_SECONDS.observe(started - waited)
+            try:
+                await send_method(chat_id=chat_id, **send_args)
+                SEND_SECONDS.observe(time.perf_counter() - started)
+                MESSAGES.inc(result="sent")
+                return True
+            except RetryAfter as e:
+                MESSAGES.inc(result="retry_after")
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                logger.warning(f"Flood limit hit for {chat_id}, retrying in {retry_after}s (attempt {attempt + 1})")
+                await asyncio.sleep(retry_after)
+            except Exception as e:
+                MESSAGES.inc(result="failed")
+                logger.warning(f"Failed to send to {chat_id}: {e}")
+                return False
+        MESSAGES.inc(result="failed")
+        return False
+
+    async def send_all(
+        self,
+        chat_ids: Union[Iterable[int], AsyncIterable[int]],
+        send_method: Callable[..., Awaitable[Any]],
+        send_args: Dict[str, Any],
+        on_sent: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> BroadcastStats:
+        """
+        Send `send_method(chat_id=..., **send_args)` to every chat id.
+
+        :param chat_ids: Chat ids, either a plain iterable or an async iterable that is
+            consumed lazily (e.g. chat ids streamed from ChatRegistry's SSCAN batches).
+        :param on_sent: Optional coroutine called with each chat id after a successful send;
+            its errors are logged and do not stop the run.
+        :return: Counters and wall-clock duration of the run.
+        """
+        stats = BroadcastStats()
+        started = time.monotonic()
+
+        if isinstance(chat_ids, AsyncIterable):
+            source = chat_ids.__aiter__()
+            # an async generator must not be advanced by two workers at once
+            source_lock = asyncio.Lock()
+
+            async def next_chat_id() -> Optional[int]:
+                async with source_lock:
+                    try:
+                        return await source.__anext__()
+                    except StopAsyncIteration:
+                        return None
+        else:
+            source = iter(chat_ids)
+
+            async def next_chat_id() -> Optional[int]:
+                return next(source, None)
+
+        async def worker():
+            while (chat_id := await next_chat_id()) is not None:
+                if await self._send_one(chat_id, send_method, send_args):
+                    stats.sent += 1
+                    if on_sent is not None:
+                        # best effort: a lost checkpoint at worst re-sends this chat after a crash
+                        try:
+                            await on_sent(chat_id)
+                        except Exception as e:
+                            logger.warning(f"Checkpoint failed for {chat_id}: {e}")
+                else:
+                    stats.failed += 1
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # e.g. the chat id source failed: stop the other workers instead of leaving them fanning out
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        stats.duration = time.monotonic() - started
+        FANOUT_SECONDS.observe(stats.duration)
+        self.per_chat.prune()
+        return stats
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from telegram import Bot
+from redis_helper.helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+
+class InviteLinkCache:
+    """
+    Serves chat invite links from Redis. Lookups never call the Bot API: a missing
+    link is generated once by a background task and kept, since every generated
+    link stays in the chat's admin list; chats where that fails (typically because
+    the bot is not an admin) are backed off exponentially.
+    """
+
+    def __init__(
+        self,
+        redis_helper: RedisHelper,
+        base_backoff: int = 3600,
+        max_backoff: int = 7 * 24 * 3600,
+    ):
+        self.redis = redis_helper
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._refreshing: dict[int, asyncio.Task] = {}
+
+    @classmethod
+    def from_env(cls, redis_helper: RedisHelper) -> "InviteLinkCache":
+        """
+        Build a cache from ARG_INVITE_LINK_BACKOFF (seconds).
+        """
+        return cls(
+            redis_helper,
+            base_backoff=int(os.getenv("ARG_INVITE_LINK_BACKOFF", "3600")),
+        )
+
+    async def get(self, bot: Bot, chat: dict) -> Optional[str]:
+        """
+        Return the cached invite link of a chat, or None if there is none yet.
+        Schedules a background refresh when the link is missing.
+
+        :param bot: Bot used by the background refresh.
+        :param chat: Chat dict as returned by `Chat.to_dict()`.
+        """
+        if chat.get("type") == "private":
+            return None
+
+        # public chats have a permanent link, no API call needed
+        if chat.get("username"):
+            return f"https://t.me/{chat['username']}"
+
+        chat_id = chat["id"]
+        try:
+            link, backed_off = await self.redis.get_invite_link(chat_id)
+        except Exception as e:
+            logger.warning(f"Could not read cached invite link for chat {chat_id}: {e}")
+            return None
+
+        if link is None and not backed_off:
+            self._schedule_refresh(bot, chat_id)
+        return link
+
+    def _schedule_refresh(self, bot: Bot, chat_id: int) -> None:
+        task = self._refreshing.get(chat_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.get_running_loop().create_task(self._refresh(bot, chat_id))
+        self._refreshing[chat_id] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(chat_id, None))
+
+    async def _refresh(self, bot: Bot, chat_id: int) -> None:
+        try:
+            # create an additional link instead of export_chat_invite_link, which revokes the primary one
+            invite = await bot.create_chat_invite_link(chat_id, name="#arg")
+            await self.redis.set_invite_link(chat_id, invite.invite_link)
+            logger.info(f"Generated invite link for chat {chat_id}: {invite.invite_link}")
+        except Exception as e:
+            try:
+                backoff = await self.redis.record_invite_link_failure(chat_id, self.base_backoff, self.max_backoff)
+                logger.warning(f"Could not generate invite link for chat {chat_id}, retrying in {backoff}s: {e}")
+            except Exception as redis_error:
+                logger.error(f"Could not record invite link failure for chat {chat_id}: {redis_error}")
@@ -8,14 +8,28 @@ from telegram.ext import (
 )
 
 from bots.base_bot import BaseBot
+from telemetry import registry
+from typing import Awaitable, Callable, Dict, List
+import asyncio
 import os
 
+BROADCASTS_PUBLISHED = registry.counter(
+    "manager_broadcasts_published_total", "Broadcasts published to the stream by source.", ("source",)
+)
+
 class ArgManagerBot(BaseBot):
+    TOP_SIZE = 10
+
     def __init__(self, logger, redis_helper):
         super().__init__(logger, redis_helper)
         self.waiting_for_message = set()
         self.broadcast_password = os.getenv("MANAGER_PASSWORD")
         self.channel_id = int(os.getenv("SOURCE_CHANNEL_ID"))
+        # albums arrive as one update per item; an album is published once no item
+        # has arrived for this many seconds
+        self.media_group_delay = float(os.getenv("MANAGER_MEDIA_GROUP_DELAY", "1.0"))
+        # media_group_id -> {"messages": [...], "publish": coroutine function, "task": debounce task}
+        self._albums: Dict[str, dict] = {}
         if not self.broadcast_password:
             raise RuntimeError("MANAGER_PASSWORD is not set in environment variables")
 
@@ -24,15 +38,77 @@ class ArgManagerBot(BaseBot):
         app.add_handler(CommandHandler("auth", self.handle_auth))
         app.add_handler(CommandHandler("send", self.handle_send))
         app.add_handler(CommandHandler("top", self.handle_top))
+        app.add_handler(CommandHandler("top_hour", self.handle_top_hour))
+        app.add_handler(CommandHandler("top_day", self.handle_top_day))
         app.add_handler(CommandHandler("clear", self.handle_clear))
-        app.add_handler(MessageHandler(~filters.ALL, self.handle_message))
+        app.add_handler(CommandHandler("stats", self.handle_stats))
+        app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & ~filters.COMMAND, self.handle_message))
         app.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST, self.handle_channel_post))
+        app.post_init = self.on_startup
+        app.post_shutdown = self.on_shutdown
+
+    async def on_startup(self, app: Application) -> None:
+        await self.redis.ensure_leaderboard()
+
+    async def on_shutdown(self, app: Application) -> None:
+        # publish albums still waiting for their debounce instead of dropping them
+        for group_id in list(self._albums):
+            self._albums[group_id]["task"].cancel()
+            await self._publish_album(group_id)
+        await self.redis.close()
+
+    def collect_album(self, message: Message, publish: Callable[[List[Message]], Awaitable[None]]) -> None:
+        """
+        Buffer one item of an album (media group) and (re)start its debounce timer.
+
+        :param publish: Called with the album's messages in order once it is complete.
+        """
+        album = self._albums.setdefault(message.media_group_id, {"messages": [], "publish": publish, "task": None})
+        album["messages"].append(message)
+        if album["task"] is not None:
+            album["task"].cancel()
+        album["task"] = asyncio.create_task(self._publish_album_later(message.media_group_id))
+
+    async def _publish_album_later(self, group_id: str) -> None:
+        await asyncio.sleep(self.media_group_delay)
+        await self._publish_album(group_id)
+
+    async def _publish_album(self, group_id: str) -> None:
+        album = self._albums.pop(group_id, None)
+        if album is None:
+            return
+        messages = sorted(album["messages"], key=lambda m: m.message_id)
+        try:
+            await album["publish"](messages)
+        except Exception as e:
+            self.logger.error(f"Failed to publish album {group_id}: {e}")
+
+    async def publish_media_group(self, messages: List[Message]) -> None:
+        await self.redis.publish_raw_dict({
+            "content_type": "media_group",
+            "messages": [message.to_dict() for message in messages],
+        })
+        BROADCASTS_PUBLISHED.inc(source="send")
+
+    async def publish_channel_forward(self, messages: List[Message]) -> None:
+        message_ids = [message.message_id for message in messages]
+        self.logger.info(f"Поймали пост из канала {self.channel_id}, msg_ids={message_ids}")
+        await self.redis.publish_raw_dict({
+            "content_type": "forward_from_channel",
+            "from_chat_id": self.channel_id,
+            "message_ids": message_ids,
+        })
+        BROADCASTS_PUBLISHED.inc(source="channel")
 
     async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text(
             "Привет! Это менеджер бот.\n"
             "/auth <password> — авторизация\n"
-            "/send — отправить сообщение всем пользователям"
+            "/send — отправить сообщение всем пользователям\n"
+            "/top [сезон] — топ чатов по активности\n"
+            "/top_hour, /top_day — топ за последний час и сутки\n"
+            "/clear — начать новый сезон\n"
+            "/stats — состояние кэша и очередей"
         )
 
     async def handle_auth(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -43,14 +119,14 @@ class ArgManagerBot(BaseBot):
         password = context.args[0]
         if password == self.broadcast_password:
             chat_id = update.effective_chat.id
-            self.redis.authorize_chat(chat_id)
+            await self.redis.authorize_chat(chat_id)
             await update.message.reply_text("Успешная авторизация.")
         else:
             await update.message.reply_text("Неверный пароль.")
 
     async def handle_send(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         chat_id = update.effective_chat.id
-        if not self.redis.is_authorized(chat_id):
+        if not await self.redis.is_authorized(chat_id):
             await update.message.reply_text("Вы не авторизованы. Используйте /auth.")
             return
 
@@ -61,68 +137,129 @@ class ArgManagerBot(BaseBot):
         message: Message = update.message
         chat_id = update.effective_chat.id
 
-        # if it's a /send flow, keep old behavior
+        # the rest of an album whose first item answered /send
+        if message.media_group_id and message.media_group_id in self._albums:
+            self.collect_album(message, self.publish_media_group)
+            return
+
         if chat_id in self.waiting_for_message:
             self.waiting_for_message.remove(chat_id)
-            message_dict = message.to_dict()
-            self.redis.publish_raw_dict({
-                "content_type": "message_dict",
-                "message": message_dict
-            })
-            return
+            if message.media_group_id:
+                self.collect_album(message, self.publish_media_group)
+                return
+            # publish_raw_dict wraps it into the message_dict envelope itself
+            await self.redis.publish_raw_dict(message.to_dict())
+            BROADCASTS_PUBLISHED.inc(source="send")
 
     async def handle_top(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         chat_id = update.effective_chat.id
-        if not self.redis.is_authorized(chat_id):
+        if not await self.redis.is_authorized(chat_id):
             await update.message.reply_text("Вы не авторизованы. Используйте /auth.")
             return
 
-        metrics = self.redis.get_all_metrics()
-        if not metrics:
-            await update.message.reply_text("Нет данных для отображения.")
+        season = None
+        if context.args:
+            try:
+                season = int(context.args[0])
+            except ValueError:
+                await update.message.reply_text("Использование: /top [номер сезона]")
+                return
+
+        await self.reply_top(
+            update,
+            lambda limit, offset: self.redis.get_top_metrics(limit=limit, offset=offset, season=season),
+            "🏆 Топ участников по активности:",
+        )
+
+    async def handle_top_hour(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await self.handle_window_top(update, 1, "⏱ Топ чатов за последний час:")
+
+    async def handle_top_day(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await self.handle_window_top(update, 24, "📅 Топ чатов за последние сутки:")
+
+    async def handle_window_top(self, update: Update, hours: int, header: str) -> None:
+        chat_id = update.effective_chat.id
+        if not await self.redis.is_authorized(chat_id):
+            await update.message.reply_text("Вы не авторизованы. Используйте /auth.")
             return
 
-        top_list = sorted(metrics, key=lambda x: x.get("count", 0), reverse=True)
+        await self.reply_top(
+            update, lambda limit, offset: self.redis.get_top_activity(hours, limit=limit, offset=offset), header
+        )
 
+    async def reply_top(
+        self, update: Update, fetch_page: Callable[[int, int], Awaitable[List[dict]]], header: str
+    ) -> None:
+        """
+        Reply with the TOP_SIZE first chats returned by `fetch_page(limit, offset)`.
+        """
         response_lines = []
-        response_length = 0
-        
-        i = 1
-        for item in top_list:
-            title = item.get("title", "")
-            username = item.get("username", "")
-            count = item.get("count", 0)
-            inviteLink = item.get("invite_link", "")
-            response_line = ''
-
-            if response_length == 10: 
-              break;
-
-            if inviteLink and title:
-                response_line = f'{i}. <a href="{inviteLink}">{title}</a> — {count}'
-                i += 1
-                response_length += 1
-            elif title:
-                response_line = f'{i}. {title} — {count}'
-                i += 1
-                response_length += 1
-            elif username:
-                continue;
-            
-            response_lines.append(response_line)
-
-        response_text = "🏆 Топ участников по активности:\n" + "\n".join(response_lines)
+        offset = 0
+        page_size = self.TOP_SIZE * 2
+
+        # chats without a title are skipped, so page through the leaderboard until
+        # TOP_SIZE rows are collected or it runs out
+        while len(response_lines) < self.TOP_SIZE:
+            page = await fetch_page(page_size, offset)
+            offset += page_size
+
+            for item in page:
+                title = item.get("title", "")
+                count = item.get("count", 0)
+                inviteLink = item.get("invite_link", "")
+                i = len(response_lines) + 1
+                if "users" in item:
+                    count = f"{count} (людей: {item['users']})"
+
+                if inviteLink and title:
+                    response_lines.append(f'{i}. <a href="{inviteLink}">{title}</a> — {count}')
+                elif title:
+                    response_lines.append(f'{i}. {title} — {count}')
+
+                if len(response_lines) == self.TOP_SIZE:
+                    break
+
+            if len(page) < page_size:
+                break
+
+        if not response_lines:
+            await update.message.reply_text("Нет данных для отображения.")
+            return
+
+        response_text = header + "\n" + "\n".join(response_lines)
         await update.message.reply_text(response_text, parse_mode="HTML")
 
     async def handle_clear(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
-        if not self.redis.is_authorized(chat_id):
+        if not await self.redis.is_authorized(chat_id):
+            await update.message.reply_text("Вы не авторизованы. Используйте /auth.")
+            return
+
+        season, count = await self.redis.start_new_season()
+        await update.message.reply_text(
+            f"Счётчики активности сброшены до 0 для {count} чатов. Начался сезон {season}, "
+            f"итоги прошлого: /top {season - 1}"
+        )
+
+    async def handle_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat_id = update.effective_chat.id
+        if not await self.redis.is_authorized(chat_id):
             await update.message.reply_text("Вы не авторизованы. Используйте /auth.")
             return
 
-        count = self.redis.reset_all_counts()
+        cache = await self.redis.get_result_cache_stats()
+        lookups = cache["hits"] + cache["misses"]
+        hit_rate = cache["hits"] / lookups * 100 if lookups else 0
+        queue = await self.redis.get_render_queue_stats()
+        shed = await self.redis.get_admission_stats()
+        shed_line = ", ".join(f"{reason}: {count}" for reason, count in sorted(shed.items())) or "нет"
         await update.message.reply_text(
-            f"Счётчики активности сброшены до 0 для {count} чатов."
+            f"Кэш готовых картинок: {cache['hits']} попаданий, {cache['misses']} промахов ({hit_rate:.1f}%)\n"
+            f"Очередь рендера: {queue['queued']} ждут, {queue['in_progress']} в работе, "
+            f"воркеров: {queue['consumers']}\n"
+            f"Задержка рендера: средняя {queue['latency_avg']:.2f}с, последняя {queue['latency_last']:.2f}с "
+            f"({queue['jobs']} задач)\n"
+            f"Отклонено /arg при перегрузке: {shed_line}"
         )
 
     async def handle_channel_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -131,9 +268,7 @@ class ArgManagerBot(BaseBot):
             return
 
         if message.chat.id == self.channel_id:
-            self.logger.info(f"Поймали пост из канала {self.channel_id}, msg_id={message.message_id}")
-            self.redis.publish_raw_dict({
-                "content_type": "forward_from_channel",
-                "from_chat_id": self.channel_id,
-                "message_id": message.message_id,
-            })
+            if message.media_group_id:
+                self.collect_album(message, self.publish_channel_forward)
+                return
+            await self.publish_channel_forward([message])
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from bots.rendering import OVERLAY_VERSION, EncodeSettings, render_arg_jpeg_timed
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+RENDER_STAGE_SECONDS = registry.histogram(
+    "arg_render_stage_seconds", "Time spent in each rendering stage.", ("stage",)
+)
+RENDER_OUTPUT_BYTES = registry.histogram(
+    "arg_render_output_bytes", "Size of the encoded JPEGs.",
+    buckets=(50_000, 100_000, 200_000, 350_000, 500_000, 750_000, 1_000_000, 2_000_000, 5_000_000),
+)
+RENDER_REJECTED = registry.counter("arg_render_rejected_total", "Renders rejected because the pool was full.")
+
+
+class RenderPoolOverloaded(RuntimeError):
+    """
+    Raised when the render pool already holds the maximum number of pending jobs.
+    """
+
+
+class RenderPool:
+    """
+    Runs image rendering on a thread or process pool so that the event loop only
+    does network I/O. The number of submitted but unfinished jobs is bounded by
+    `max_pending`; anything above it is rejected with RenderPoolOverloaded.
+    """
+
+    EXECUTOR_KINDS = ("thread", "process")
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        encode_settings: Optional[EncodeSettings] = None,
+    ):
+        if kind not in self.EXECUTOR_KINDS:
+            raise ValueError(f"Unsupported render executor: {kind}")
+
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.encode_settings = encode_settings or EncodeSettings()
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+
+    @classmethod
+    def from_env(cls) -> "RenderPool":
+        """
+        Build a pool from ARG_RENDER_EXECUTOR (thread|process), ARG_RENDER_WORKERS
+        and ARG_RENDER_MAX_PENDING, with encoder settings from EncodeSettings.from_env.
+        """
+        workers = os.getenv("ARG_RENDER_WORKERS")
+        max_pending = os.getenv("ARG_RENDER_MAX_PENDING")
+        return cls(
+            kind=os.getenv("ARG_RENDER_EXECUTOR", "thread").lower(),
+            max_workers=int(workers) if workers else None,
+            max_pending=int(max_pending) if max_pending else None,
+            encode_settings=EncodeSettings.from_env(),
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="render")
+            logger.info(f"Started {self.kind} render pool with {self.max_workers} workers, max pending {self.max_pending}.")
+        return self._executor
+
+    async def run(self, fn: Callable, *args):
+        """
+        Run `fn(*args)` on the pool. `fn` must be a module-level function when the
+        pool is process-based.
+
+        :raises RenderPoolOverloaded: If `max_pending` jobs are already queued or running.
+        """
+        if self._pending >= self.max_pending:
+            RENDER_REJECTED.inc()
+            raise RenderPoolOverloaded(f"Render pool is full ({self._pending} pending jobs)")
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def render(self, data: bytes, target_resolution: Optional[int] = None) -> bytes:
+        """
+        Stamp the downloaded photo bytes with "#arg" and return the encoded JPEG bytes.
+
+        :param target_resolution: Longest side the photo may be decoded down to.
+        """
+        started = time.perf_counter()
+        result, timings = await self.run(render_arg_jpeg_timed, data, target_resolution, self.encode_settings)
+        for stage, seconds in timings.items():
+            RENDER_STAGE_SECONDS.observe(seconds, stage=stage)
+        # includes waiting for a free worker
+        RENDER_STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
+        RENDER_OUTPUT_BYTES.observe(len(result))
+        return result
+
+    def result_version(self, target_resolution: Optional[int] = None) -> str:
+        """
+        Version of the results `render` produces, part of the rendered result cache key.
+        """
+        return f"{OVERLAY_VERSION}:{target_resolution}:{self.encode_settings.cache_key}"
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from telegram import Bot, InputFile, ReplyParameters
+from telegram.error import BadRequest, Forbidden
+
+from bots.render_pool import RenderPool
+from redis_helper.helper import RedisHelper
+from telemetry import registry
+
+JOB_SECONDS = registry.histogram(
+    "render_job_seconds", "Time from enqueueing a render job to acknowledging it.",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+JOB_STAGE_SECONDS = registry.histogram(
+    "render_job_stage_seconds", "Time spent in each network stage of a render job.", ("stage",)
+)
+JOBS = registry.counter("render_jobs_total", "Processed render jobs by result.", ("result",))
+
+
+class RenderWorker:
+    """
+    Consumes render jobs enqueued by ArgBot from the Redis render queue: downloads
+    the source photo, stamps it and replies in the original chat. Any number of
+    workers (processes or hosts) can share the queue.
+    """
+
+    def __init__(self, logger: logging.Logger, redis_helper: RedisHelper, bot: Bot):
+        self.logger = logger
+        self.redis = redis_helper
+        self.bot = bot
+        self.render_pool = RenderPool.from_env()
+        self.concurrency = int(os.getenv("RENDER_WORKER_CONCURRENCY", str(self.render_pool.max_workers)))
+        self.consumer = os.getenv("RENDER_WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+        self.result_cache_ttl = int(os.getenv("ARG_RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+
+    async def run(self) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        async with self.bot:
+            try:
+                async for entry_id, job in self.redis.consume_render_jobs(self.consumer, count=self.concurrency):
+                    await slots.acquire()
+                    task = asyncio.create_task(self._run_job(entry_id, job))
+                    tasks.add(task)
+                    task.add_done_callback(lambda t: (tasks.discard(t), slots.release()))
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # let cancelled jobs unwind before the pool and the Redis connections go away
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self.render_pool.shutdown()
+                await self.redis.close()
+
+    async def _run_job(self, entry_id: str, job: dict) -> None:
+        if not job:
+            self.logger.warning(f"Dropping unreadable render job {entry_id}")
+            JOBS.inc(result="unreadable")
+            await self.redis.ack_render_job(entry_id, 0.0)
+            return
+
+        try:
+            await self.process_job(job)
+        except (BadRequest, Forbidden) as e:
+            # the chat or the source photo is gone, retrying will not help
+            self.logger.warning(f"Render job {entry_id} failed permanently: {e}")
+            JOBS.inc(result="dropped")
+        except Exception as e:
+            # left pending; a worker (maybe this one) claims it again after RENDER_CLAIM_IDLE_MS
+            self.logger.error(f"Render job {entry_id} failed: {e}")
+            JOBS.inc(result="failed")
+            return
+        else:
+            JOBS.inc(result="done")
+
+        latency = time.time() - job.get("enqueued_at", time.time())
+        JOB_SECONDS.observe(latency)
+        await self.redis.ack_render_job(entry_id, latency)
+        self.logger.info(f"Render job {entry_id} for chat {job['chat_id']} done in {latency:.2f}s")
+
+    async def process_job(self, job: dict) -> None:
+        with JOB_STAGE_SECONDS.time(stage="download"):
+            telegram_file = await self.bot.get_file(job["file_id"])
+            data = await telegram_file.download_as_bytearray()
+
+        result = await self.render_pool.render(bytes(data), job.get("target_resolution"))
+
+        with JOB_STAGE_SECONDS.time(stage="upload"):
+            sent = await self.bot.send_photo(
+                chat_id=job["chat_id"],
+                photo=InputFile(result, filename="result.jpg"),
+                reply_parameters=ReplyParameters(
+                    message_id=job["reply_to_message_id"], allow_sending_without_reply=True
+                ),
+            )
+
+        try:
+            # versioned by the settings this worker encoded with, which may differ from the bot's
+            await self.redis.cache_result(
+                job["file_unique_id"],
+                self.render_pool.result_version(job.get("target_resolution")),
+                sent.photo[-1].file_id,
+                self.result_cache_ttl,
+            )
+        except Exception as e:
+            self.logger.warning(f"Could not cache rendered result: {e}")
@@ -0,0 +1,353 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
+from typing import Optional
+from PIL import Image, ImageDraw, ImageFont
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_SHARP_PATH = os.path.join(BASE_DIR, "..", "assets", "1.otf")
+FONT_ARG_PATH = os.path.join(BASE_DIR, "..", "assets", "2.ttf")
+
+for font_path in [FONT_SHARP_PATH, FONT_ARG_PATH]:
+    if not os.path.exists(font_path):
+        raise FileNotFoundError(f"Missing font file: {font_path}")
+
+# bump whenever the overlay or encoding changes so cached results are not reused
+OVERLAY_VERSION = "3"
+
+TEXT_SHARP = "#"
+TEXT_ARG = "arg"
+SPACING = 10
+MIN_FONT_SIZE = 11
+FALLBACK_FONT_SIZE = 12
+# room around the text origin for the outline and glyphs overhanging their advance box
+SPRITE_PADDING = 4
+# Telegram stores photos at most 2560px on the longest side, anything larger is wasted upload
+TELEGRAM_MAX_PHOTO_SIDE = 2560
+
+
+@dataclass(frozen=True)
+class EncodeSettings:
+    """
+    JPEG encoder settings for rendered photos. The defaults keep Pillow's quality
+    75 and 4:2:0 subsampling, so results look as before, but add the lossless
+    Huffman optimisation and cap the size at what Telegram stores anyway.
+
+    `subsampling` follows Pillow: 0 is 4:4:4, 1 is 4:2:2, 2 is 4:2:0. When
+    `target_bytes` is set, the highest quality between `min_quality` and `quality`
+    whose output fits into it is chosen by binary search; if even `min_quality`
+    does not fit, the `min_quality` output is used.
+    """
+    quality: int = 75
+    optimize: bool = True
+    progressive: bool = False
+    subsampling: int = 2
+    max_dimension: Optional[int] = TELEGRAM_MAX_PHOTO_SIDE
+    target_bytes: Optional[int] = None
+    min_quality: int = 50
+
+    @classmethod
+    def from_env(cls) -> "EncodeSettings":
+        """
+        Build settings from ARG_JPEG_QUALITY, ARG_JPEG_OPTIMIZE, ARG_JPEG_PROGRESSIVE,
+        ARG_JPEG_SUBSAMPLING, ARG_MAX_DIMENSION, ARG_TARGET_BYTES and ARG_JPEG_MIN_QUALITY.
+        ARG_MAX_DIMENSION=0 and ARG_TARGET_BYTES=0 turn the downscale and the budget off.
+        """
+        def flag(name: str, default: bool) -> bool:
+            return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+        return cls(
+            quality=int(os.getenv("ARG_JPEG_QUALITY", "75")),
+            optimize=flag("ARG_JPEG_OPTIMIZE", True),
+            progressive=flag("ARG_JPEG_PROGRESSIVE", False),
+            subsampling=int(os.getenv("ARG_JPEG_SUBSAMPLING", "2")),
+            max_dimension=int(os.getenv("ARG_MAX_DIMENSION", str(TELEGRAM_MAX_PHOTO_SIDE))) or None,
+            target_bytes=int(os.getenv("ARG_TARGET_BYTES", "0")) or None,
+            min_quality=int(os.getenv("ARG_JPEG_MIN_QUALITY", "50")),
+        )
+
+    @property
+    def cache_key(self) -> str:
+        """
+        Short fingerprint of the settings, part of the rendered result cache key.
+        """
+        return (
+            f"q{self.quality}o{int(self.optimize)}p{int(self.progressive)}s{self.subsampling}"
+            f"d{self.max_dimension or 0}t{self.target_bytes or 0}m{self.min_quality}"
+        )
+
+
+DEFAULT_ENCODE_SETTINGS = EncodeSettings()
+
+# one output buffer per rendering thread, reused across photos and quality probes
+_buffers = threading.local()
+
+
+@dataclass(frozen=True)
+class FontLayout:
+    """
+    Loaded fonts for one size together with the measured "#"/"arg" metrics.
+    """
+    size: int
+    font_sharp: ImageFont.FreeTypeFont
+    font_arg: ImageFont.FreeTypeFont
+    width_sharp: float
+    width_arg: float
+    height: int
+
+    @property
+    def total_width(self) -> float:
+        return self.width_sharp + self.width_arg + SPACING
+
+
+class FontLayoutCache:
+    """
+    Keeps FreeTypeFont objects and text measurements per font size, and the fitted
+    size per image dimensions, so that a warm cache never touches the font files.
+    """
+
+    def __init__(self, max_dimensions: int = 1024):
+        self.max_dimensions = max_dimensions
+        self._layouts: dict[int, FontLayout] = {}
+        self._fitted: "OrderedDict[tuple[int, int], int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def layout_for_size(self, size: int) -> FontLayout:
+        """
+        Return the layout for a font size, loading and measuring the fonts on first use.
+
+        :param size: Font size in points.
+        """
+        layout = self._layouts.get(size)
+        if layout is not None:
+            return layout
+
+        font_sharp = ImageFont.truetype(FONT_SHARP_PATH, size)
+        font_arg = ImageFont.truetype(FONT_ARG_PATH, size)
+        layout = FontLayout(
+            size=size,
+            font_sharp=font_sharp,
+            font_arg=font_arg,
+            width_sharp=font_sharp.getlength(TEXT_SHARP),
+            width_arg=font_arg.getlength(TEXT_ARG),
+            height=max(font_sharp.getbbox(TEXT_SHARP)[3], font_arg.getbbox(TEXT_ARG)[3]),
+        )
+        with self._lock:
+            self._layouts.setdefault(size, layout)
+        return self._layouts[size]
+
+    def fit(self, image_width: int, image_height: int) -> FontLayout:
+        """
+        Return the largest layout (starting at 5% of the image height) whose text
+        fits into 95% of the image width.
+
+        :param image_width: Width of the target image in pixels.
+        :param image_height: Height of the target image in pixels.
+        """
+        key = (image_width, image_height)
+        with self._lock:
+            size = self._fitted.get(key)
+            if size is not None:
+                self._fitted.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if size is None:
+            size = self._search_size(image_width, image_height)
+            with self._lock:
+                self._fitted[key] = size
+                if len(self._fitted) > self.max_dimensions:
+                    self._fitted.popitem(last=False)
+
+        return self.layout_for_size(size)
+
+    def _search_size(self, image_width: int, image_height: int) -> int:
+        # Text width grows monotonically with the font size, so binary search
+        # for the largest size that still fits instead of counting down.
+        max_width = image_width * 0.95
+        low, high = MIN_FONT_SIZE, int(image_height * 0.05)
+        best = None
+        while low <= high:
+            mid = (low + high) // 2
+            if self.layout_for_size(mid).total_width <= max_width:
+                best = mid
+                low = mid + 1
+            else:
+                high = mid - 1
+        return best if best is not None else FALLBACK_FONT_SIZE
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters of the dimensions lookup and the cache sizes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "fitted_dimensions": len(self._fitted),
+                "font_sizes": len(self._layouts),
+            }
+
+
+font_cache = FontLayoutCache()
+
+
+@lru_cache(maxsize=64)
+def render_stamp_sprite(size: int) -> Image.Image:
+    """
+    Rasterize the "#arg" stamp with its black outline once per font size into an
+    RGBA sprite. The text origin sits at (SPRITE_PADDING, SPRITE_PADDING).
+    """
+    layout = font_cache.layout_for_size(size)
+    sprite = Image.new(
+        "RGBA",
+        (math.ceil(layout.total_width) + 2 * SPRITE_PADDING, layout.height + 2 * SPRITE_PADDING),
+        (0, 0, 0, 0),
+    )
+    draw = ImageDraw.Draw(sprite)
+
+    def draw_with_shadow(pos, font, text, fill="white"):
+        for dx, dy in [(-1, -1), (1, -1), (-1, 1), (1, 1)]:
+            draw.text((pos[0] + dx, pos[1] + dy), text, font=font, fill="black")
+        draw.text(pos, text, font=font, fill=fill)
+
+    draw_with_shadow((SPRITE_PADDING, SPRITE_PADDING), layout.font_sharp, TEXT_SHARP)
+    draw_with_shadow((SPRITE_PADDING + layout.width_sharp + SPACING, SPRITE_PADDING), layout.font_arg, TEXT_ARG)
+    return sprite
+
+
+def stamp_image(image: Image.Image) -> Image.Image:
+    """
+    Composite the cached "#arg" sprite onto the bottom of the image in a single paste.
+    """
+    layout = font_cache.fit(image.width, image.height)
+    sprite = render_stamp_sprite(layout.size)
+
+    x = int((image.width - layout.total_width) // 2)
+    y = image.height - layout.height - 20
+    image.paste(sprite, (x - SPRITE_PADDING, y - SPRITE_PADDING), sprite)
+    return image
+
+
+def draw_arg_on_image(image: Image.Image, settings: EncodeSettings = DEFAULT_ENCODE_SETTINGS) -> BytesIO:
+    """
+    Stamp "#arg" at the bottom of the image and return it encoded as JPEG.
+    """
+    stamp_image(image)
+
+    result = BytesIO(encode_jpeg(image, settings))
+    result.name = "result.jpg"
+    return result
+
+
+def _save_jpeg(image: Image.Image, buffer: BytesIO, settings: EncodeSettings, quality: int) -> int:
+    buffer.seek(0)
+    buffer.truncate()
+    image.save(
+        buffer, "JPEG",
+        quality=quality,
+        optimize=settings.optimize,
+        progressive=settings.progressive,
+        subsampling=settings.subsampling,
+    )
+    return buffer.tell()
+
+
+def encode_jpeg(image: Image.Image, settings: EncodeSettings = DEFAULT_ENCODE_SETTINGS) -> bytes:
+    """
+    Encode the image as JPEG with `settings`, honouring `settings.target_bytes`.
+    The encoder writes into a per-thread buffer that is reused between calls.
+    """
+    buffer = getattr(_buffers, "jpeg", None)
+    if buffer is None:
+        buffer = _buffers.jpeg = BytesIO()
+
+    size = _save_jpeg(image, buffer, settings, settings.quality)
+    if not settings.target_bytes or size <= settings.target_bytes:
+        return buffer.getvalue()
+
+    # largest quality in [min_quality, quality) that fits; ~3 probes for the default range
+    low, high = settings.min_quality, settings.quality - 1
+    best, probed = None, settings.quality
+    while low <= high:
+        probed = (low + high) // 2
+        if _save_jpeg(image, buffer, settings, probed) <= settings.target_bytes:
+            best = probed
+            low = probed + 1
+        else:
+            high = probed - 1
+
+    final = best if best is not None else settings.min_quality
+    # the buffer holds the last probe, which is not necessarily the one we keep
+    if final != probed:
+        _save_jpeg(image, buffer, settings, final)
+    return buffer.getvalue()
+
+
+def decode_image(
+    data: bytes, target_resolution: Optional[int] = None, max_dimension: Optional[int] = None
+) -> Image.Image:
+    """
+    Decode photo bytes into an RGB image. When `target_resolution` (longest side) is
+    smaller than the photo, JPEGs are decoded in draft mode at the smallest DCT scale
+    that still covers it. The RGB conversion copy is skipped if the image is already RGB.
+    Images whose longest side still exceeds `max_dimension` are scaled down to it.
+    """
+    image = Image.open(BytesIO(data))
+    if target_resolution and image.format == "JPEG":
+        ratio = target_resolution / max(image.size)
+        if ratio < 1:
+            image.draft("RGB", (math.ceil(image.width * ratio), math.ceil(image.height * ratio)))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max_dimension and max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return image
+
+
+def render_arg_jpeg(
+    data: bytes, target_resolution: Optional[int] = None, settings: EncodeSettings = DEFAULT_ENCODE_SETTINGS
+) -> bytes:
+    """
+    Decode the downloaded photo, stamp it and return the encoded JPEG bytes.
+    Module-level so that it can be submitted to a process pool.
+    """
+    return render_arg_jpeg_timed(data, target_resolution, settings)[0]
+
+
+def render_arg_jpeg_timed(
+    data: bytes, target_resolution: Optional[int] = None, settings: EncodeSettings = DEFAULT_ENCODE_SETTINGS
+) -> tuple[bytes, dict]:
+    """
+    Same as `render_arg_jpeg`, but also return the seconds spent in each stage
+    (decode, font_fit, draw, encode). The timings travel back with the result so
+    that they can be recorded in the parent even when rendering in a process pool.
+    """
+    started = time.perf_counter()
+    image = decode_image(data, target_resolution, settings.max_dimension)
+    image.load()
+    decoded = time.perf_counter()
+
+    font_cache.fit(image.width, image.height)
+    fitted = time.perf_counter()
+
+    stamp_image(image)
+    drawn = time.perf_counter()
+
+    result = encode_jpeg(image, settings)
+    encoded = time.perf_counter()
+
+    return result, {
+        "decode": decoded - started,
+        "font_fit": fitted - decoded,
+        "draw": drawn - fitted,
+        "encode": encoded - drawn,
+    }
@@ -0,0 +1,124 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+from typing import Callable, Iterable, Optional
+
+from redis_helper.helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring over replica ids. Each replica gets `vnodes` points on the
+    ring, so adding or removing one replica only moves the chats it gains or loses.
+    """
+
+    def __init__(self, replicas: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self.replicas = tuple(sorted(set(replicas)))
+        points = sorted((_hash(f"{replica}#{i}"), replica) for replica in self.replicas for i in range(vnodes))
+        self._keys = [point for point, _ in points]
+        self._owners = [replica for _, replica in points]
+
+    @property
+    def epoch(self) -> str:
+        """
+        Fingerprint of the membership; replicas that agree on it agree on every owner.
+        """
+        return hashlib.blake2b(",".join(self.replicas).encode(), digest_size=6).hexdigest()
+
+    def owner(self, chat_id: int) -> Optional[str]:
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(str(chat_id))) % len(self._keys)
+        return self._owners[index]
+
+
+class ReplicaMembership:
+    """
+    Registers this ArgBot replica in Redis with a periodic heartbeat and keeps a
+    HashRing of the live replicas. Replicas that miss their heartbeats for `ttl`
+    seconds are dropped from the ring (and from Redis, with their consumer groups),
+    and `on_change` is called so that their share of running broadcasts can be
+    taken over. `on_change` must not block: a late heartbeat would make this
+    replica look dead.
+    """
+
+    def __init__(self, redis_helper: RedisHelper, replica_id: str, heartbeat_interval: float = 10.0, ttl: float = 30.0):
+        self.redis = redis_helper
+        self.replica_id = replica_id
+        self.heartbeat_interval = heartbeat_interval
+        self.ttl = ttl
+        # empty until the first refresh, so that it always reports a change
+        self.ring = HashRing()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, redis_helper: RedisHelper) -> "ReplicaMembership":
+        """
+        Build the membership from ARG_REPLICA_ID (defaults to "arg-bot", must be stable
+        and unique per replica), ARG_REPLICA_HEARTBEAT and ARG_REPLICA_TTL (seconds).
+        """
+        return cls(
+            redis_helper,
+            replica_id=os.getenv("ARG_REPLICA_ID", "arg-bot"),
+            heartbeat_interval=float(os.getenv("ARG_REPLICA_HEARTBEAT", "10")),
+            ttl=float(os.getenv("ARG_REPLICA_TTL", "30")),
+        )
+
+    async def refresh(self) -> bool:
+        """
+        Send a heartbeat and rebuild the ring from the live replicas.
+
+        :return: True if the membership changed.
+        """
+        alive = await self.redis.heartbeat_replica(self.replica_id, self.ttl)
+        # every replica prunes, so groups of replicas gone before it started are dropped too
+        await self.redis.prune_replicas(self.ttl)
+        if tuple(sorted(alive)) == self.ring.replicas:
+            return False
+
+        removed = set(self.ring.replicas) - set(alive)
+        added = set(alive) - set(self.ring.replicas)
+        self.ring = HashRing(alive, self.ring.vnodes)
+        logger.info(
+            f"Replica membership changed (+{sorted(added)} -{sorted(removed)}), "
+            f"{len(alive)} live replicas, epoch {self.ring.epoch}."
+        )
+        return True
+
+    async def _run(self, on_change: Callable[[], None]) -> None:
+        while True:
+            try:
+                if await self.refresh():
+                    on_change()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Replica heartbeat failed: {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def start(self, on_change: Callable[[], None]) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(on_change))
+
+    async def stop(self) -> None:
+        """
+        Stop the heartbeat and leave the ring, so that the other replicas rebalance
+        right away instead of after `ttl`.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.redis.remove_replica(self.replica_id)
+        except Exception as e:
+            logger.warning(f"Could not unregister replica {self.replica_id}: {e}")
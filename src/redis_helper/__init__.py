@@ -1,3 +1,28 @@
 __version__ = "0.1.0"
 
-from .helper import RedisHelper
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+# Imported on first access, see bots/__init__.py
+_EXPORTS = {
+    "RedisHelper": ".helper",
+    "MetricsWriter": ".metrics_writer",
+    "ChatRegistry": ".chat_registry",
+}
+
+if TYPE_CHECKING:
+    from .helper import RedisHelper
+    from .metrics_writer import MetricsWriter
+    from .chat_registry import ChatRegistry
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import time
+from array import array
+from typing import AsyncGenerator, Optional
+
+from redis_helper.helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRegistry:
+    """
+    Local copy of the broadcast audience (the `chat_ids` set) kept as an array of
+    64-bit ints, about 8 bytes per chat instead of a list of Python ints.
+
+    The cache is filled by streaming SSCAN batches, which are handed to the caller
+    as they arrive, and is kept current incrementally: chats added through this
+    process are inserted locally, and before each use an SCARD tells whether
+    another process added chats, in which case the set is scanned again.
+    """
+
+    def __init__(self, redis_helper: RedisHelper, batch_size: int = 1000, max_age: float = 3600.0):
+        self.redis = redis_helper
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self._ids: Optional[array] = None
+        self._loaded_at = 0.0
+        self._scan_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls, redis_helper: RedisHelper) -> "ChatRegistry":
+        """
+        Build a registry from ARG_CHAT_SCAN_BATCH and ARG_CHAT_CACHE_MAX_AGE (seconds).
+        """
+        return cls(
+            redis_helper,
+            batch_size=int(os.getenv("ARG_CHAT_SCAN_BATCH", "1000")),
+            max_age=float(os.getenv("ARG_CHAT_CACHE_MAX_AGE", "3600")),
+        )
+
+    def __len__(self) -> int:
+        return len(self._ids) if self._ids is not None else 0
+
+    def add(self, chat_id: int) -> None:
+        """
+        Insert a chat that was just added to Redis, keeping the cache in sync without a rescan.
+        """
+        if self._ids is not None and chat_id not in self._ids:
+            self._ids.append(chat_id)
+
+    async def _is_fresh(self) -> bool:
+        if self._ids is None or time.monotonic() - self._loaded_at > self.max_age:
+            return False
+        try:
+            return await self.redis.count_chat_ids() == len(self._ids)
+        except Exception as e:
+            logger.warning(f"Could not check the chat registry size, using the cached copy: {e}")
+            return True
+
+    async def iter_batches(self) -> AsyncGenerator[array, None]:
+        """
+        Yield all chat ids in batches of about `batch_size`: slices of the cache when
+        it is current, otherwise SSCAN batches as they arrive while the cache is rebuilt.
+        """
+        if await self._is_fresh():
+            ids = self._ids
+            for start in range(0, len(ids), self.batch_size):
+                yield ids[start:start + self.batch_size]
+            return
+
+        async with self._scan_lock:
+            # another broadcast may have rebuilt the cache while we waited
+            if await self._is_fresh():
+                scanned = None
+            else:
+                scanned = array("q")
+                # SSCAN may return an id more than once while the set is rehashed
+                seen = set()
+                started = time.monotonic()
+                async for batch in self.redis.scan_chat_ids(self.batch_size):
+                    fresh = array("q")
+                    for chat_id in batch:
+                        if chat_id not in seen:
+                            seen.add(chat_id)
+                            fresh.append(chat_id)
+                    scanned.extend(fresh)
+                    if fresh:
+                        yield fresh
+
+                # if SSCAN missed ids, the SCARD check fails next time and we rescan
+                self._ids = scanned
+                self._loaded_at = started
+                logger.info(f"Loaded {len(self._ids)} chat ids into the registry.")
+
+        if scanned is None:
+            async for batch in self.iter_batches():
+                yield batch
@@ -1,132 +1,748 @@
-import redis
+import redis.asyncio as redis
+from redis.exceptions import NoScriptError
 import logging
 import json
+import time
 from typing import AsyncGenerator
-import asyncio
 from telegram import Message
 
 logger = logging.getLogger(__name__)
 
+# KEYS: metrics hash, current season id
+# ARGV: chat id, increment, leaderboard key prefix, then field/value pairs of the chat
+# if the hash exists -> HINCRBY the lifetime count and refresh invite_link
+# else -> HSET all fields + count=increment
+# in both cases add the increment to the leaderboard of the current season; the season
+# is read inside the script so increments never straddle a season bump
+SAVE_METRIC_LUA = """
+local key = KEYS[1]
+local chat_id = ARGV[1]
+local increment = tonumber(ARGV[2])
+local season = redis.call("GET", KEYS[2]) or "0"
+local leaderboard = ARGV[3] .. ":" .. season
+local n = #ARGV
+if redis.call("EXISTS", key) == 1 then
+    redis.call("HINCRBY", key, "count", increment)
+    for i=4, n-1, 2 do
+        if ARGV[i] == "invite_link" then
+            redis.call("HSET", key, "invite_link", ARGV[i+1])
+        end
+    end
+else
+    for i=4, n-1, 2 do
+        redis.call("HSET", key, ARGV[i], ARGV[i+1])
+    end
+    redis.call("HSET", key, "count", increment)
+end
+return redis.call("ZINCRBY", leaderboard, increment, chat_id)
+"""
+
+# KEYS: current season id
+# ARGV: leaderboard key prefix, retention of finished seasons in seconds
+# bumps the season and lets the previous leaderboard expire; returns {new season, chats in old season}
+NEW_SEASON_LUA = """
+local season = redis.call("INCR", KEYS[1])
+local previous = ARGV[1] .. ":" .. (season - 1)
+local chats = redis.call("ZCARD", previous)
+redis.call("EXPIRE", previous, tonumber(ARGV[2]))
+return {season, chats}
+"""
+
+# KEYS: cached result, hit/miss stats hash
+# returns the cached file_id (or false) and counts the lookup as a hit or a miss
+GET_RESULT_LUA = """
+local file_id = redis.call("GET", KEYS[1])
+if file_id then
+    redis.call("HINCRBY", KEYS[2], "hits", 1)
+else
+    redis.call("HINCRBY", KEYS[2], "misses", 1)
+end
+return file_id
+"""
+
+# KEYS: finished broadcasts zset, active broadcasts zset, broadcast watermark
+# ARGV: entry id, now
+# advances the watermark (newest entry any replica has registered) and registers the
+# broadcast as running unless it already finished; returns 0 for finished broadcasts
+START_BROADCAST_LUA = """
+local function newer(a, b)
+    if not b then
+        return true
+    end
+    local a_ms, a_seq = string.match(a, "^(%d+)-(%d+)$")
+    local b_ms, b_seq = string.match(b, "^(%d+)-(%d+)$")
+    a_ms, b_ms = tonumber(a_ms), tonumber(b_ms)
+    return a_ms > b_ms or (a_ms == b_ms and tonumber(a_seq) > tonumber(b_seq))
+end
+if newer(ARGV[1], redis.call("GET", KEYS[3])) then
+    redis.call("SET", KEYS[3], ARGV[1])
+end
+if redis.call("ZSCORE", KEYS[1], ARGV[1]) then
+    return 0
+end
+redis.call("ZADD", KEYS[2], "NX", ARGV[2], ARGV[1])
+return 1
+"""
+
+# KEYS: broadcast claims hash, broadcast sent set, replica heartbeats zset, active broadcasts zset
+# ARGV: replica id, oldest live heartbeat, ttl, entry id, chat ids...
+# claims the chats not yet delivered whose claim is free, ours, or held by a dead replica;
+# claims nothing once the broadcast is finished and its progress is gone
+CLAIM_CHATS_LUA = """
+local claimed = {}
+if not redis.call("ZSCORE", KEYS[4], ARGV[4]) then
+    return claimed
+end
+local min_beat = tonumber(ARGV[2])
+for i = 5, #ARGV do
+    local chat_id = ARGV[i]
+    if redis.call("SISMEMBER", KEYS[2], chat_id) == 0 then
+        local owner = redis.call("HGET", KEYS[1], chat_id)
+        local take = (not owner) or owner == ARGV[1]
+        if not take then
+            local beat = redis.call("ZSCORE", KEYS[3], owner)
+            take = (not beat) or tonumber(beat) < min_beat
+        end
+        if take then
+            redis.call("HSET", KEYS[1], chat_id, ARGV[1])
+            claimed[#claimed + 1] = chat_id
+        end
+    end
+end
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+return claimed
+"""
+
+# KEYS: done set, claims hash, sent set, active zset, finished zset, replicas zset
+# ARGV: entry id, this pass as "replica@epoch", epoch, now, ttl, min heartbeat, caller's ring replicas...
+# records the pass and, once every replica alive right now finished a pass under the
+# caller's membership epoch, drops the per-broadcast state and marks the broadcast
+# finished; a caller with a stale view (missing a live replica or still counting a
+# dead one) never finishes it, the rebalance after its next refresh does
+FINISH_PASS_LUA = """
+redis.call("SADD", KEYS[1], ARGV[2])
+redis.call("EXPIRE", KEYS[1], ARGV[5])
+local ring = {}
+for i = 7, #ARGV do
+    ring[ARGV[i]] = true
+end
+local alive = redis.call("ZRANGEBYSCORE", KEYS[6], ARGV[6], "+inf")
+if #alive ~= #ARGV - 6 then
+    return 0
+end
+for _, replica in ipairs(alive) do
+    if not ring[replica] or redis.call("SISMEMBER", KEYS[1], replica .. "@" .. ARGV[3]) == 0 then
+        return 0
+    end
+end
+redis.call("DEL", KEYS[1], KEYS[2], KEYS[3])
+redis.call("ZREM", KEYS[4], ARGV[1])
+redis.call("ZADD", KEYS[5], ARGV[4], ARGV[1])
+redis.call("ZREMRANGEBYSCORE", KEYS[5], "-inf", tonumber(ARGV[4]) - tonumber(ARGV[5]))
+return 1
+"""
+
+
 class RedisHelper:
-    BROADCAST_CHANNEL = "broadcasts"
+    BROADCAST_STREAM = "broadcasts:stream"
+    BROADCAST_GROUP = "arg-bot"
+    BROADCAST_PROGRESS_PREFIX = "broadcasts:sent"
+    BROADCAST_CLAIMS_PREFIX = "broadcasts:claimed"
+    BROADCAST_DONE_PREFIX = "broadcasts:done"
+    ACTIVE_BROADCASTS_KEY = "broadcasts:active"
+    FINISHED_BROADCASTS_KEY = "broadcasts:finished"
+    # newest stream entry registered by any replica; new consumer groups start after it
+    BROADCAST_WATERMARK_KEY = "broadcasts:watermark"
+    REPLICAS_KEY = "broadcasts:replicas"
+    BROADCAST_STREAM_MAXLEN = 1000
+    BROADCAST_PROGRESS_TTL = 7 * 24 * 3600
+    STREAM_BLOCK_MS = 5000
+    STREAM_CLAIM_INTERVAL = 5.0
+    BROADCAST_CLAIM_IDLE_MS = 30 * 60 * 1000
+    RENDER_STREAM = "render:jobs"
+    RENDER_GROUP = "render-workers"
+    RENDER_STREAM_MAXLEN = 10000
+    RENDER_CLAIM_IDLE_MS = 60 * 1000
+    RENDER_STATS_KEY = "render:stats"
+    INVITE_LINK_PREFIX = "invite_link"
+    INVITE_LINK_FAILURES_TTL = 7 * 24 * 3600
+    RESULT_CACHE_PREFIX = "arg:result"
+    RESULT_CACHE_STATS_KEY = "arg:result:stats"
+    ADMISSION_STATS_KEY = "arg:admission:stats"
     AUTHORIZED_CHATS_KEY = "authorized_chats"
+    CHAT_IDS_KEY = "chat_ids"
     METRICS_KEY_PREFIX = "metrics"
+    # kept outside the metrics:* namespace so that scans over the hashes never see it
+    LEADERBOARD_KEY_PREFIX = "leaderboard:metrics"
+    LEADERBOARD_MIGRATED_KEY = "leaderboard:migrated"
+    SEASON_KEY = "leaderboard:season"
+    SEASON_RETENTION = 180 * 24 * 3600
+    # hourly activity buckets: a zset of chat -> count and a HyperLogLog of users per chat
+    ACTIVITY_KEY_PREFIX = "activity:hour"
+    ACTIVITY_USERS_PREFIX = "activity:users"
+    ACTIVITY_WINDOW_PREFIX = "activity:window"
+    ACTIVITY_BUCKET = 3600
+    # longest window that can be queried; buckets expire once they fall out of it
+    ACTIVITY_RETENTION = 24 * 3600
+    # merged windows are reused for this long, so paging through a top does not re-merge
+    ACTIVITY_WINDOW_CACHE = 60
 
     def __init__(self, redis_url: str = None):
         if not redis_url:
             raise RuntimeError("REDIS_URL environment variable is not set")
-        self.client = redis.Redis.from_url(redis_url, decode_responses=True)  # decode=True for str payloads
+        # one pool shared by all commands, including blocking stream reads; decode=True for str payloads
+        self.pool = redis.ConnectionPool.from_url(redis_url, decode_responses=True)
+        self.client = redis.Redis(connection_pool=self.pool)
+        # registered once; redis-py calls it with EVALSHA and loads it on NOSCRIPT
+        self._metric_script = self.client.register_script(SAVE_METRIC_LUA)
+        self._new_season_script = self.client.register_script(NEW_SEASON_LUA)
+        self._get_result_script = self.client.register_script(GET_RESULT_LUA)
+        self._start_broadcast_script = self.client.register_script(START_BROADCAST_LUA)
+        self._claim_chats_script = self.client.register_script(CLAIM_CHATS_LUA)
+        self._finish_pass_script = self.client.register_script(FINISH_PASS_LUA)
+        # save_metrics_batch queues EVALSHA itself; a script passed client=pipe would cost a SCRIPT EXISTS per flush
+        self._metric_script_loaded = False
 
-    def is_authorized(self, chat_id: int) -> bool:
+    async def close(self) -> None:
+        """
+        Close the client and disconnect every pooled connection.
+        """
+        await self.client.aclose()
+        await self.pool.disconnect()
+
+    async def is_authorized(self, chat_id: int) -> bool:
         """
         Check if a chat is authorized to use the bot.
 
         :param chat_id: The ID of the chat to check.
         :return: True if the chat is authorized, False otherwise.
         """
-        return self.client.sismember(self.AUTHORIZED_CHATS_KEY, chat_id)
+        return bool(await self.client.sismember(self.AUTHORIZED_CHATS_KEY, chat_id))
 
-    def authorize_chat(self, chat_id: int) -> None:
+    async def authorize_chat(self, chat_id: int) -> None:
         """
         Authorize a chat to use the bot.
 
         :param chat_id: The ID of the chat to add to the redis authorized set.
         """
-        self.client.sadd(self.AUTHORIZED_CHATS_KEY, chat_id)
+        await self.client.sadd(self.AUTHORIZED_CHATS_KEY, chat_id)
+
+    async def get_invite_link(self, chat_id: int) -> tuple[str, bool]:
+        """
+        Read the cached invite link of a chat in one round-trip.
+
+        :return: (link or None, whether lookups are backed off after a failure)
+        """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(f"{self.INVITE_LINK_PREFIX}:{chat_id}")
+        pipe.exists(f"{self.INVITE_LINK_PREFIX}:backoff:{chat_id}")
+        link, backoff = await pipe.execute()
+        return link, bool(backoff)
+
+    async def set_invite_link(self, chat_id: int, link: str) -> None:
+        """
+        Store a freshly generated invite link and clear any failure backoff. The link
+        does not expire: generated links never do either, so a new one would only pile
+        up next to it in the chat's admin list.
+        """
+        pipe = self.client.pipeline()
+        pipe.set(f"{self.INVITE_LINK_PREFIX}:{chat_id}", link)
+        pipe.delete(
+            f"{self.INVITE_LINK_PREFIX}:backoff:{chat_id}",
+            f"{self.INVITE_LINK_PREFIX}:failures:{chat_id}",
+        )
+        await pipe.execute()
+
+    async def record_invite_link_failure(self, chat_id: int, base_backoff: int, max_backoff: int) -> int:
+        """
+        Negatively cache a failed invite link lookup (e.g. the bot is not an admin).
+        The backoff doubles with every consecutive failure.
+
+        :return: The backoff in seconds until the next attempt.
+        """
+        failures_key = f"{self.INVITE_LINK_PREFIX}:failures:{chat_id}"
+        pipe = self.client.pipeline()
+        pipe.incr(failures_key)
+        pipe.expire(failures_key, self.INVITE_LINK_FAILURES_TTL)
+        failures, _ = await pipe.execute()
+
+        backoff = min(base_backoff * 2 ** (failures - 1), max_backoff)
+        await self.client.set(f"{self.INVITE_LINK_PREFIX}:backoff:{chat_id}", failures, ex=backoff)
+        return backoff
+
+    async def get_cached_result(self, file_unique_id: str, version: str) -> str:
+        """
+        Look up the file_id of an already rendered photo and count the hit or miss.
+
+        :param file_unique_id: Unique id of the source photo.
+        :param version: Overlay/encoding version the result was rendered with.
+        :return: The file_id of the rendered photo, or None.
+        """
+        key = f"{self.RESULT_CACHE_PREFIX}:{version}:{file_unique_id}"
+        return await self._get_result_script(keys=[key, self.RESULT_CACHE_STATS_KEY]) or None
+
+    async def cache_result(self, file_unique_id: str, version: str, file_id: str, ttl: int) -> None:
+        """
+        Remember the file_id Telegram assigned to the rendered photo for `ttl` seconds.
+        """
+        await self.client.set(f"{self.RESULT_CACHE_PREFIX}:{version}:{file_unique_id}", file_id, ex=ttl)
+
+    async def get_result_cache_stats(self) -> dict:
+        """
+        Return hit and miss counters of the rendered result cache.
+        """
+        stats = await self.client.hgetall(self.RESULT_CACHE_STATS_KEY)
+        return {"hits": int(stats.get("hits", 0)), "misses": int(stats.get("misses", 0))}
+
+    async def record_admission_shed(self, reason: str) -> None:
+        """
+        Count an /arg request shed by admission control, per reason.
+        """
+        await self.client.hincrby(self.ADMISSION_STATS_KEY, reason, 1)
+
+    async def get_admission_stats(self) -> dict:
+        """
+        Return the shed /arg counters per reason.
+        """
+        return {reason: int(count) for reason, count in (await self.client.hgetall(self.ADMISSION_STATS_KEY)).items()}
 
-    def add_chat_id(self, chat_id: int) -> bool:
+    async def add_chat_id(self, chat_id: int) -> bool:
         try:
-            added = self.client.sadd("chat_ids", chat_id)
+            added = await self.client.sadd(self.CHAT_IDS_KEY, chat_id)
             logger.info(f"Chat ID {chat_id} {'added' if added else 'already exists'} in Redis.")
             return bool(added)
         except Exception as e:
             logger.error(f"Error adding chat_id to Redis: {e}")
             return False
 
-    def get_all_chat_ids(self) -> list[int]:
-        try:
-            ids = self.client.smembers("chat_ids")
-            return [int(cid) for cid in ids]
-        except Exception as e:
-            logger.error(f"Error retrieving chat_ids from Redis: {e}")
-            return []
+    async def scan_chat_ids(self, batch_size: int = 1000) -> AsyncGenerator[list[int], None]:
+        """
+        Stream the chat ids with SSCAN, one batch of roughly `batch_size` ids per
+        round-trip. Like any SSCAN, ids added during the scan may be missed and an
+        id may be returned twice if the set is resized meanwhile.
+        """
+        cursor = 0
+        while True:
+            cursor, ids = await self.client.sscan(self.CHAT_IDS_KEY, cursor, count=batch_size)
+            if ids:
+                yield [int(cid) for cid in ids]
+            if not cursor:
+                return
+
+    async def count_chat_ids(self) -> int:
+        return await self.client.scard(self.CHAT_IDS_KEY)
 
-    def publish_raw_dict(self, message_dict: dict) -> bool:
+    async def publish_raw_dict(self, message_dict: dict) -> bool:
+        """
+        Append a broadcast to the durable broadcast stream.
+        """
         try:
-            self.client.publish(self.BROADCAST_CHANNEL, json.dumps({
-                "content_type": "message_dict",
-                "message": message_dict
-            }))
+            await self.client.xadd(
+                self.BROADCAST_STREAM,
+                {"payload": json.dumps({
+                    "content_type": "message_dict",
+                    "message": message_dict
+                })},
+                maxlen=self.BROADCAST_STREAM_MAXLEN,
+                approximate=True,
+            )
             return True
         except Exception as e:
             logger.error(f"Failed to publish raw message dict: {e}")
             return False
 
+    async def _ensure_group(self, stream: str, group: str, start_id: str = "0") -> None:
+        """
+        Create a consumer group (and the stream) if it does not exist yet, reading
+        from `start_id` ("0" for the whole stream, "$" for new entries only).
+        """
+        try:
+            await self.client.xgroup_create(stream, group, id=start_id, mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
 
-    async def subscribe_to_broadcasts(self) -> AsyncGenerator[dict, None]:
+    def _parse_stream_entries(self, entries) -> list[tuple[str, dict]]:
+        parsed = []
+        for entry_id, fields in entries:
+            if not fields:
+                # entry was trimmed from the stream while pending, nothing left to deliver
+                parsed.append((entry_id, None))
+                continue
+            try:
+                parsed.append((entry_id, json.loads(fields["payload"])))
+            except Exception as parse_error:
+                logger.warning(f"Failed to parse stream entry JSON {entry_id}: {parse_error}")
+                parsed.append((entry_id, None))
+        return parsed
+
+    async def _consume_stream(
+        self, stream: str, group: str, consumer: str, claim_idle_ms: int, count: int = 1, start_id: str = "0"
+    ) -> AsyncGenerator[tuple[str, dict], None]:
+        """
+        Yield `(entry_id, payload)` pairs of a stream for one consumer of a group.
+        Entries left pending by this consumer (e.g. after a crash) are yielded first, then
+        new ones. Every STREAM_CLAIM_INTERVAL seconds, busy stream or not, entries held
+        for longer than `claim_idle_ms` (by dead consumers, or failed and left pending)
+        are claimed, so that they are retried instead of sitting in the pending list.
+        Unparsable entries are yielded with `None`.
+        """
+        await self._ensure_group(stream, group, start_id)
+
+        # 1. our own unacknowledged entries
+        response = await self.client.xreadgroup(group, consumer, {stream: "0"})
+        for _, entries in response:
+            for item in self._parse_stream_entries(entries):
+                yield item
+
+        claim_cursor = "0-0"
+        next_claim = time.monotonic() + self.STREAM_CLAIM_INTERVAL
+        while True:
+            # 2. new entries; XREADGROUP blocks server-side until something arrives
+            response = await self.client.xreadgroup(
+                group, consumer, {stream: ">"}, count=count, block=self.STREAM_BLOCK_MS,
+            )
+            for _, entries in response or ():
+                for item in self._parse_stream_entries(entries):
+                    yield item
+
+            # 3. on a timer, pick up entries stuck in the pending list
+            if time.monotonic() < next_claim:
+                continue
+            autoclaim = await self.client.xautoclaim(
+                stream, group, consumer, min_idle_time=claim_idle_ms, start_id=claim_cursor, count=count,
+            )
+            # a long pending list is walked `count` entries per round, then the timer restarts
+            claim_cursor = autoclaim[0]
+            if claim_cursor == "0-0":
+                next_claim = time.monotonic() + self.STREAM_CLAIM_INTERVAL
+            for item in self._parse_stream_entries(autoclaim[1]):
+                yield item
+
+    def broadcast_group(self, replica_id: str) -> str:
+        return f"{self.BROADCAST_GROUP}:{replica_id}"
+
+    async def _broadcast_watermark(self) -> str:
         """
-        Async generator that yields broadcast messages as dicts.
-        Usage: `async for msg in redis_helper.subscribe_to_broadcasts(): ...`
+        Stream id a new broadcast consumer group starts after. Entries up to it have
+        been registered by some replica, so they are either finished or running (and
+        served by rebalancing); everything after it has not been seen by anyone.
         """
+        watermark = await self.client.get(self.BROADCAST_WATERMARK_KEY)
+        if watermark:
+            return watermark
+        # before per-replica groups every replica read through the shared group
         try:
-            pubsub = self.client.pubsub()
-            pubsub.subscribe(self.BROADCAST_CHANNEL)
-
-            logger.info("Subscribed to Redis broadcast channel.")
-
-            while True:
-                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
-                if message and message["type"] == "message":
-                    try:
-                        yield json.loads(message["data"])
-                    except Exception as parse_error:
-                        logger.warning(f"Failed to parse broadcast JSON: {parse_error}")
-                await asyncio.sleep(0.25)
-        except Exception as e:
-            logger.error(f"Redis subscription error: {e}")
-            return
-        
-    def get_all_metrics(self) -> list[dict]:
+            groups = await self.client.xinfo_groups(self.BROADCAST_STREAM)
+        except redis.ResponseError:
+            # no stream yet
+            return "0"
+        legacy = next((g for g in groups if g["name"] == self.BROADCAST_GROUP), None)
+        return legacy["last-delivered-id"] if legacy else "0"
+
+    async def consume_broadcasts(self, replica_id: str) -> AsyncGenerator[tuple[str, dict], None]:
+        """
+        Async generator that yields `(entry_id, broadcast)` pairs from the broadcast stream,
+        resuming this replica's unacknowledged entries first. Every replica reads through
+        its own consumer group, so each one sees every broadcast and serves its share of
+        the chats; a new group starts after the broadcast watermark, so broadcasts
+        published while no replica was running are still delivered. Every yielded entry
+        must be confirmed with `ack_broadcast`; unparsable entries are yielded with `None`.
+        Usage: `async for entry_id, msg in redis_helper.consume_broadcasts("replica-1"): ...`
+
+        :param replica_id: Stable, unique name of this bot replica.
+        """
+        logger.info(f"Consuming broadcast stream as {replica_id}.")
+        start_id = await self._broadcast_watermark()
+        async for item in self._consume_stream(
+            self.BROADCAST_STREAM, self.broadcast_group(replica_id), replica_id,
+            self.BROADCAST_CLAIM_IDLE_MS, start_id=start_id,
+        ):
+            yield item
+
+    async def enqueue_render_job(self, job: dict) -> str:
+        """
+        Append a render job to the render queue stream.
+
+        :return: The stream entry id of the job.
+        """
+        job = {**job, "enqueued_at": time.time()}
+        return await self.client.xadd(
+            self.RENDER_STREAM, {"payload": json.dumps(job)},
+            maxlen=self.RENDER_STREAM_MAXLEN, approximate=True,
+        )
+
+    def consume_render_jobs(self, consumer: str, count: int = 1) -> AsyncGenerator[tuple[str, dict], None]:
+        """
+        Async generator that yields `(entry_id, job)` pairs from the render queue.
+        Every yielded job must be confirmed with `ack_render_job`.
+
+        :param consumer: Unique consumer name of the worker.
+        :param count: Maximum number of jobs fetched per read.
+        """
+        logger.info(f"Consuming render jobs as {consumer}.")
+        return self._consume_stream(
+            self.RENDER_STREAM, self.RENDER_GROUP, consumer, self.RENDER_CLAIM_IDLE_MS, count=count
+        )
+
+    async def ack_render_job(self, entry_id: str, latency: float) -> None:
+        """
+        Acknowledge a finished render job and record its end-to-end latency.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        pipe.xack(self.RENDER_STREAM, self.RENDER_GROUP, entry_id)
+        pipe.hincrby(self.RENDER_STATS_KEY, "jobs", 1)
+        pipe.hincrbyfloat(self.RENDER_STATS_KEY, "latency_total", latency)
+        pipe.hset(self.RENDER_STATS_KEY, "latency_last", latency)
+        await pipe.execute()
+
+    async def get_render_queue_stats(self) -> dict:
+        """
+        Return the render queue depth (jobs not yet picked up), jobs in progress and
+        latency counters of finished jobs.
+        """
+        await self._ensure_group(self.RENDER_STREAM, self.RENDER_GROUP)
+        groups = await self.client.xinfo_groups(self.RENDER_STREAM)
+        group = next((g for g in groups if g["name"] == self.RENDER_GROUP), {})
+        stats = await self.client.hgetall(self.RENDER_STATS_KEY)
+
+        jobs = int(stats.get("jobs", 0))
+        return {
+            "queued": group.get("lag") or 0,
+            "in_progress": group.get("pending", 0),
+            "consumers": group.get("consumers", 0),
+            "jobs": jobs,
+            "latency_avg": float(stats.get("latency_total", 0)) / jobs if jobs else 0.0,
+            "latency_last": float(stats.get("latency_last", 0)),
+        }
+
+    async def ack_broadcast(self, entry_id: str, replica_id: str) -> None:
+        """
+        Acknowledge a broadcast in this replica's consumer group. The shared progress
+        is dropped by `finish_broadcast_pass` once every replica is done.
+        """
+        await self.client.xack(self.BROADCAST_STREAM, self.broadcast_group(replica_id), entry_id)
+
+    async def heartbeat_replica(self, replica_id: str, ttl: float) -> list[str]:
+        """
+        Record a heartbeat for this replica and return the ids of all replicas that
+        sent one within the last `ttl` seconds, this one included.
         """
-        Method that returns list of metrics for each chat that participates in the competition.
-        Each element of the list contains list of metrics for each chat.
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd(self.REPLICAS_KEY, {replica_id: now})
+        pipe.zrangebyscore(self.REPLICAS_KEY, now - ttl, "+inf")
+        return (await pipe.execute())[1]
+
+    async def prune_replicas(self, ttl: float) -> list[str]:
         """
+        Forget replicas without a heartbeat in the last `ttl` seconds and destroy every
+        per-replica broadcast consumer group that has no live replica, including groups
+        of replicas this process never saw. Returns the pruned replica ids.
+        """
+        now = time.time()
+        dead = await self.client.zrangebyscore(self.REPLICAS_KEY, "-inf", f"({now - ttl}")
+        if dead:
+            await self.client.zrem(self.REPLICAS_KEY, *dead)
+        alive = set(await self.client.zrangebyscore(self.REPLICAS_KEY, now - ttl, "+inf"))
         try:
-            keys = self.client.keys(f"{self.METRICS_KEY_PREFIX}:*")
-            metrics_list = []
+            groups = await self.client.xinfo_groups(self.BROADCAST_STREAM)
+        except redis.ResponseError:
+            # the stream does not exist yet
+            return dead
 
-            for key in keys:
-                data = self.client.hgetall(key)
-                if not data:
-                    continue
+        prefix = self.broadcast_group("")
+        for group in groups:
+            if group["name"].startswith(prefix) and group["name"][len(prefix):] not in alive:
+                await self.client.xgroup_destroy(self.BROADCAST_STREAM, group["name"])
+                logger.info(f"Destroyed broadcast group {group['name']} ({group['pending']} pending).")
+        return dead
 
-                if "count" in data:
-                    try:
-                        data["count"] = int(data["count"])
-                    except ValueError:
-                        data["count"] = 0
+    async def remove_replica(self, replica_id: str) -> None:
+        """
+        Drop a replica from the live set and destroy its consumer group. A restart
+        under the same id starts a new group from the broadcast watermark.
+        """
+        await self.client.zrem(self.REPLICAS_KEY, replica_id)
+        try:
+            await self.client.xgroup_destroy(self.BROADCAST_STREAM, self.broadcast_group(replica_id))
+        except redis.ResponseError:
+            # the stream does not exist yet
+            pass
 
-                chat_id_str = key.split(":")[1]
-                try:
-                    data["chat_id"] = int(chat_id_str)
-                except ValueError:
-                    data["chat_id"] = chat_id_str
+    async def start_broadcast(self, entry_id: str) -> bool:
+        """
+        Register a broadcast as running so that replicas joining or taking over later
+        can serve their share too.
 
-                metrics_list.append(data)
+        :return: False if the broadcast has already been finished.
+        """
+        started = await self._start_broadcast_script(
+            keys=[self.FINISHED_BROADCASTS_KEY, self.ACTIVE_BROADCASTS_KEY, self.BROADCAST_WATERMARK_KEY],
+            args=[entry_id, time.time()],
+        )
+        return bool(started)
 
-            return metrics_list
+    async def get_active_broadcasts(self) -> list[tuple[str, dict]]:
+        """
+        Return `(entry_id, broadcast)` for every running broadcast, oldest first.
+        Broadcasts older than the progress TTL or trimmed from the stream are dropped.
+        """
+        await self.client.zremrangebyscore(self.ACTIVE_BROADCASTS_KEY, "-inf", time.time() - self.BROADCAST_PROGRESS_TTL)
+        active = []
+        for entry_id in await self.client.zrange(self.ACTIVE_BROADCASTS_KEY, 0, -1):
+            entries = await self.client.xrange(self.BROADCAST_STREAM, entry_id, entry_id)
+            parsed = self._parse_stream_entries(entries)
+            if not parsed or parsed[0][1] is None:
+                await self.client.zrem(self.ACTIVE_BROADCASTS_KEY, entry_id)
+                continue
+            active.append(parsed[0])
+        return active
+
+    async def claim_broadcast_chats(
+        self, entry_id: str, replica_id: str, chat_ids: list[int], replica_ttl: float
+    ) -> list[int]:
+        """
+        Atomically claim chats for delivering a broadcast from this replica. A chat is
+        claimed unless it was already delivered or is claimed by another live replica;
+        claims of replicas without a heartbeat for `replica_ttl` seconds are taken over.
+
+        :return: The claimed chat ids, which this replica must now serve.
+        """
+        if not chat_ids:
+            return []
+        claimed = await self._claim_chats_script(
+            keys=[
+                f"{self.BROADCAST_CLAIMS_PREFIX}:{entry_id}",
+                f"{self.BROADCAST_PROGRESS_PREFIX}:{entry_id}",
+                self.REPLICAS_KEY,
+                self.ACTIVE_BROADCASTS_KEY,
+            ],
+            args=[replica_id, time.time() - replica_ttl, self.BROADCAST_PROGRESS_TTL, entry_id, *chat_ids],
+        )
+        return [int(chat_id) for chat_id in claimed]
+
+    async def finish_broadcast_pass(
+        self, entry_id: str, replica_id: str, epoch: str, replicas: list[str], replica_ttl: float
+    ) -> bool:
+        """
+        Record that this replica served its share of a broadcast under the membership
+        `epoch`. Once every live replica has done so under the same epoch, the
+        broadcast's shared state is deleted and it is marked finished. Nothing is
+        finished while `replicas` (the caller's ring) differs from the live replicas.
+
+        :return: True if this call finished the broadcast.
+        """
+        now = time.time()
+        finished = await self._finish_pass_script(
+            keys=[
+                f"{self.BROADCAST_DONE_PREFIX}:{entry_id}",
+                f"{self.BROADCAST_CLAIMS_PREFIX}:{entry_id}",
+                f"{self.BROADCAST_PROGRESS_PREFIX}:{entry_id}",
+                self.ACTIVE_BROADCASTS_KEY,
+                self.FINISHED_BROADCASTS_KEY,
+                self.REPLICAS_KEY,
+            ],
+            args=[
+                entry_id, f"{replica_id}@{epoch}", epoch, now, self.BROADCAST_PROGRESS_TTL, now - replica_ttl,
+                *replicas,
+            ],
+        )
+        return bool(finished)
+
+    async def mark_broadcast_sent(self, entry_id: str, chat_id: int) -> None:
+        """
+        Checkpoint that a broadcast has been delivered to a chat.
+        """
+        key = f"{self.BROADCAST_PROGRESS_PREFIX}:{entry_id}"
+        pipe = self.client.pipeline(transaction=False)
+        pipe.sadd(key, chat_id)
+        pipe.expire(key, self.BROADCAST_PROGRESS_TTL)
+        await pipe.execute()
+
+    def _parse_metrics(self, chat_id: str, data: dict) -> dict:
+        if "count" in data:
+            try:
+                data["count"] = int(data["count"])
+            except ValueError:
+                data["count"] = 0
+
+        try:
+            data["chat_id"] = int(chat_id)
+        except ValueError:
+            data["chat_id"] = chat_id
+        return data
+
+    async def get_current_season(self) -> int:
+        return int(await self.client.get(self.SEASON_KEY) or 0)
+
+    async def start_new_season(self) -> tuple[int, int]:
+        """
+        Reset activity counters in O(1) by bumping the season id. The finished
+        season's leaderboard stays readable until it expires after SEASON_RETENTION.
+
+        :return: (new season id, number of chats that were active in the finished season)
+        """
+        season, chats = await self._new_season_script(
+            keys=[self.SEASON_KEY], args=[self.LEADERBOARD_KEY_PREFIX, self.SEASON_RETENTION]
+        )
+        logger.info(f"Started season {season}, previous season had {chats} chats.")
+        return int(season), int(chats)
+
+    async def get_top_metrics(self, limit: int = 10, offset: int = 0, season: int = None) -> list[dict]:
+        """
+        Return metrics of the most active chats of a season, highest count first. Reads
+        `limit` entries of the season leaderboard and fetches their hashes in one pipeline.
+
+        :param limit: Number of chats to return.
+        :param offset: Number of top chats to skip (for paging).
+        :param season: Season id, the current season if omitted.
+        """
+        try:
+            if season is None:
+                season = await self.get_current_season()
+            top = await self.client.zrevrange(
+                f"{self.LEADERBOARD_KEY_PREFIX}:{season}", offset, offset + limit - 1, withscores=True
+            )
+            if not top:
+                return []
+
+            pipe = self.client.pipeline(transaction=False)
+            for chat_id, _ in top:
+                pipe.hgetall(f"{self.METRICS_KEY_PREFIX}:{chat_id}")
+            hashes = await pipe.execute()
 
+            metrics_list = []
+            for (chat_id, score), data in zip(top, hashes):
+                data = self._parse_metrics(chat_id, data or {})
+                data["count"] = int(score)
+                metrics_list.append(data)
+            return metrics_list
         except Exception as e:
-            logger.error(f"Error retrieving metrics from Redis: {e}")
+            logger.error(f"Error retrieving top metrics from Redis: {e}")
             return []
-        
-    def save_or_increment_metric(self, chat: dict) -> None:
+
+    async def ensure_leaderboard(self) -> None:
         """
-        Save the metrics for the chat or increment the counter of the existing one (atomically with Lua).
+        One-off migration: fill the current season's leaderboard from the existing metrics hashes.
         """
-        chat_id = chat["id"]
-        key = f"{self.METRICS_KEY_PREFIX}:{chat_id}"
+        if await self.client.exists(self.LEADERBOARD_MIGRATED_KEY):
+            return
+
+        leaderboard = f"{self.LEADERBOARD_KEY_PREFIX}:{await self.get_current_season()}"
+        pipe = self.client.pipeline(transaction=False)
+        migrated = 0
+        async for key in self.client.scan_iter(f"{self.METRICS_KEY_PREFIX}:*"):
+            count = await self.client.hget(key, "count")
+            if count is None:
+                continue
+            pipe.zadd(leaderboard, {key.split(":", 1)[1]: int(count)})
+            migrated += 1
+        pipe.set(self.LEADERBOARD_MIGRATED_KEY, 1)
+        await pipe.execute()
+        logger.info(f"Leaderboard built from {migrated} metrics hashes.")
 
+    def _metric_args(self, chat: dict, increment: int) -> list:
         fields = {
             "id": chat["id"],
             "type": chat.get("type"),
@@ -134,59 +750,127 @@ class RedisHelper:
             "username": chat.get("username"),
             "invite_link": chat.get("invite_link"),
         }
-        
+
         # remove None values and convert to str
         fields = {k: str(v) for k, v in fields.items() if v is not None}
 
-        # Lua-script: if key exists -> HINCRBY count
-        # else -> HSET all fields + count=1
-        lua_script = """
-        local key = KEYS[1]
-        local args = ARGV
-        local n = #args
-        if redis.call("EXISTS", key) == 1 then
-            redis.call("HINCRBY", key, "count", 1)
-            for i=1, n-1, 2 do
-                if args[i] == "invite_link" then
-                    redis.call("HSET", key, "invite_link", args[i+1])
-                end
-            end
-            return redis.call("HGETALL", key)
-        else
-            for i=1, n-1, 2 do
-                redis.call("HSET", key, args[i], args[i+1])
-            end
-            redis.call("HSET", key, "count", 1)
-            return redis.call("HGETALL", key)
-        end
-        """
-
-        args = []
+        args = [chat["id"], increment, self.LEADERBOARD_KEY_PREFIX]
         for k, v in fields.items():
             args.extend([k, v])
+        return args
+
+    def _queue_activity(self, pipe, bucket: int, chat_id, increment: int, user_ids) -> None:
+        expire_at = (bucket + 1) * self.ACTIVITY_BUCKET + self.ACTIVITY_RETENTION
+        key = f"{self.ACTIVITY_KEY_PREFIX}:{bucket}"
+        pipe.zincrby(key, increment, chat_id)
+        pipe.expireat(key, expire_at)
+        if user_ids:
+            users_key = f"{self.ACTIVITY_USERS_PREFIX}:{chat_id}:{bucket}"
+            pipe.pfadd(users_key, *user_ids)
+            pipe.expireat(users_key, expire_at)
+
+    async def save_or_increment_metric(self, chat: dict, increment: int = 1, user_ids=()) -> None:
+        """
+        Save the metrics for the chat or increment the counter of the existing one (atomically with Lua),
+        and count the activity in the current hourly bucket.
+
+        :param chat: Chat dict as returned by `Chat.to_dict()`.
+        :param increment: Number of processed images to add to the counter.
+        :param user_ids: Ids of the users behind the increment, for the distinct user count.
+        """
+        await self.save_metrics_batch([(chat, increment, user_ids)])
+
+    async def save_metrics_batch(self, increments: list[tuple[dict, int, set]]) -> None:
+        """
+        Apply several `save_or_increment_metric` calls in one pipelined round-trip.
 
-        script = self.client.register_script(lua_script)
-        script(keys=[key], args=args)
-    # In RedisHelper class
-
-    def reset_all_counts(self) -> int:
-      try:
-          pattern = f"{self.METRICS_KEY_PREFIX}:*"
-          pipe = self.client.pipeline()
-          updated = 0
-
-          # Iterate safely without blocking Redis (avoid KEYS)
-          for key in self.client.scan_iter(pattern):
-              # Only reset if the hash exists and has a 'count' field
-              if self.client.hexists(key, "count"):
-                  pipe.hset(key, "count", 0)
-                  updated += 1
-
-          if updated > 0:
-              pipe.execute()
-
-          logger.info(f"Reset counters to 0 for {updated} chats.")
-          return updated
-      except Exception as e:
-          logger.error(f"Error resetting counters: {e}")
-          return 0
+        :param increments: Triples of (chat dict, increment, user ids).
+        """
+        if not increments:
+            return
+
+        if not self._metric_script_loaded:
+            await self.client.script_load(SAVE_METRIC_LUA)
+            self._metric_script_loaded = True
+
+        bucket = int(time.time() // self.ACTIVITY_BUCKET)
+        sha = self._metric_script.sha
+        pipe = self.client.pipeline(transaction=False)
+        metric_calls = []
+        for chat, increment, user_ids in increments:
+            key = f"{self.METRICS_KEY_PREFIX}:{chat['id']}"
+            args = self._metric_args(chat, increment)
+            metric_calls.append((len(pipe), key, args))
+            pipe.evalsha(sha, 2, key, self.SEASON_KEY, *args)
+            self._queue_activity(pipe, bucket, chat["id"], increment, user_ids)
+        results = await pipe.execute(raise_on_error=False)
+
+        # the script cache was flushed (e.g. Redis restarted): load it again and redo only the metric calls
+        missed = [(key, args) for index, key, args in metric_calls if isinstance(results[index], NoScriptError)]
+        errors = [result for result in results if isinstance(result, Exception) and not isinstance(result, NoScriptError)]
+        if missed:
+            await self.client.script_load(SAVE_METRIC_LUA)
+            retry = self.client.pipeline(transaction=False)
+            for key, args in missed:
+                retry.evalsha(sha, 2, key, self.SEASON_KEY, *args)
+            errors += [result for result in await retry.execute(raise_on_error=False) if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+
+    async def _activity_window(self, hours: int) -> tuple[str, list[int]]:
+        """
+        Merge the hourly buckets of the last `hours` hours into one zset with ZUNIONSTORE.
+        The window slides: the bucket that is partly older than `hours` is weighted by
+        the share of it still inside the window.
+
+        :return: The merged zset key and the buckets it covers.
+        """
+        now = time.time()
+        bucket = int(now // self.ACTIVITY_BUCKET)
+        elapsed = now / self.ACTIVITY_BUCKET - bucket
+        buckets = list(range(bucket - hours, bucket + 1))
+        weights = {f"{self.ACTIVITY_KEY_PREFIX}:{b}": 1 for b in buckets}
+        weights[f"{self.ACTIVITY_KEY_PREFIX}:{buckets[0]}"] = round(1 - elapsed, 3)
+
+        window = f"{self.ACTIVITY_WINDOW_PREFIX}:{hours}:{int(now // self.ACTIVITY_WINDOW_CACHE)}"
+        if not await self.client.exists(window):
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zunionstore(window, weights)
+            pipe.expire(window, self.ACTIVITY_WINDOW_CACHE)
+            await pipe.execute()
+        return window, buckets
+
+    async def get_top_activity(self, hours: int, limit: int = 10, offset: int = 0) -> list[dict]:
+        """
+        Return metrics of the chats most active in the last `hours` hours, highest count
+        first, with `count` for the window and `users`, the approximate number of
+        distinct users in it.
+
+        :param hours: Window length, at most ACTIVITY_RETENTION in hours.
+        :param limit: Number of chats to return.
+        :param offset: Number of top chats to skip (for paging).
+        """
+        hours = max(1, min(hours, self.ACTIVITY_RETENTION // self.ACTIVITY_BUCKET))
+        try:
+            window, buckets = await self._activity_window(hours)
+            top = await self.client.zrevrange(window, offset, offset + limit - 1, withscores=True)
+            if not top:
+                return []
+
+            pipe = self.client.pipeline(transaction=False)
+            for chat_id, _ in top:
+                pipe.hgetall(f"{self.METRICS_KEY_PREFIX}:{chat_id}")
+                # PFCOUNT over several keys counts the union of the hourly HyperLogLogs
+                pipe.pfcount(*[f"{self.ACTIVITY_USERS_PREFIX}:{chat_id}:{b}" for b in buckets])
+            results = await pipe.execute()
+
+            metrics_list = []
+            for (chat_id, score), data, users in zip(top, results[::2], results[1::2]):
+                data = self._parse_metrics(chat_id, data or {})
+                data["count"] = round(score)
+                data["users"] = users
+                metrics_list.append(data)
+            return metrics_list
+        except Exception as e:
+            logger.error(f"Error retrieving activity top from Redis: {e}")
+            return []
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from redis_helper.helper import RedisHelper
+from telemetry import registry
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = registry.histogram("arg_metrics_flush_seconds", "Duration of a batched metrics write to Redis.")
+FLUSHED_CHATS = registry.counter("arg_metrics_flushed_chats_total", "Chat metrics written to Redis, by result.", ("result",))
+
+
+class MetricsWriter:
+    """
+    Write-behind buffer for chat metrics. Increments are merged per chat in memory
+    and applied with one pipelined Redis round-trip when `flush_size` increments are
+    buffered or every `flush_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, redis_helper: RedisHelper, flush_interval: float = 2.0, flush_size: int = 100):
+        self.redis = redis_helper
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # chat id -> [latest chat dict, pending increment, user ids behind it]
+        self._buffer: dict[int, list] = {}
+        self._buffered = 0
+        self._task: Optional[asyncio.Task] = None
+        self._size_flush: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls, redis_helper: RedisHelper) -> "MetricsWriter":
+        """
+        Build a writer from ARG_METRICS_FLUSH_INTERVAL (seconds) and ARG_METRICS_FLUSH_SIZE.
+        """
+        return cls(
+            redis_helper,
+            flush_interval=float(os.getenv("ARG_METRICS_FLUSH_INTERVAL", "2")),
+            flush_size=int(os.getenv("ARG_METRICS_FLUSH_SIZE", "100")),
+        )
+
+    def _merge(self, chat: dict, increment: int, user_ids) -> None:
+        entry = self._buffer.get(chat["id"])
+        if entry is None:
+            self._buffer[chat["id"]] = [chat, increment, set(user_ids)]
+        else:
+            entry[0] = {**entry[0], **{k: v for k, v in chat.items() if v is not None}}
+            entry[1] += increment
+            entry[2].update(user_ids)
+        self._buffered += increment
+
+    def add(self, chat: dict, increment: int = 1, user_id: Optional[int] = None) -> None:
+        """
+        Buffer an increment for a chat. The latest chat fields win.
+
+        :param user_id: The user behind the increment, counted once per chat and hour.
+        """
+        self._merge(chat, increment, () if user_id is None else (user_id,))
+        if self._buffered >= self.flush_size and (self._size_flush is None or self._size_flush.done()):
+            self._size_flush = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> None:
+        """
+        Write everything buffered so far. On failure the increments are put back.
+        """
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+
+            batch, self._buffer, self._buffered = self._buffer, {}, 0
+            try:
+                with FLUSH_SECONDS.time():
+                    await self.redis.save_metrics_batch([tuple(entry) for entry in batch.values()])
+                FLUSHED_CHATS.inc(len(batch), result="ok")
+                logger.debug(f"Flushed metrics for {len(batch)} chats.")
+            except Exception as e:
+                FLUSHED_CHATS.inc(len(batch), result="error")
+                logger.error(f"Ошибка сохранения метрик: {e}")
+                for chat, increment, user_ids in batch.values():
+                    self._merge(chat, increment, user_ids)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the periodic flush and write whatever is still buffered.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
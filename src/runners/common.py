@@ -0,0 +1,91 @@
+from telegram.ext import Application
+from runners import startup
+from runners.update_processor import PerChatUpdateProcessor
+from telemetry import start_metrics_server
+import logging, os, sys
+
+
+def configure_logging() -> None:
+    logging.basicConfig(
+      level=logging.INFO,
+      format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+      handlers=[logging.StreamHandler(sys.stdout)]
+    )
+
+
+def start_telemetry() -> None:
+    """
+    Expose the process metrics at http://METRICS_HOST:METRICS_PORT/metrics when
+    METRICS_PORT is set. Set TELEMETRY_LOG_EVENTS=1 to also log every observation.
+    """
+    port = os.getenv("METRICS_PORT")
+    if port:
+        start_metrics_server(int(port), os.getenv("METRICS_HOST", "127.0.0.1"))
+
+
+def telegram_urls() -> dict:
+    """
+    Bot API endpoints overridden by TELEGRAM_API_URL / TELEGRAM_FILE_URL, e.g. to point
+    the bots at a local Bot API server or at loadtest/fake_bot_api.py.
+    """
+    urls = {
+        "base_url": os.getenv("TELEGRAM_API_URL"),
+        "base_file_url": os.getenv("TELEGRAM_FILE_URL"),
+    }
+    return {k: v for k, v in urls.items() if v}
+
+
+def build_application(token: str) -> Application:
+    """
+    Build the bot application. BOT_CONCURRENT_UPDATES (default 16) updates are handled
+    at once, with updates of the same chat still processed in order; 1 restores
+    fully sequential handling.
+    """
+    concurrency = int(os.getenv("BOT_CONCURRENT_UPDATES", "16"))
+    builder = Application.builder().token(token).concurrent_updates(PerChatUpdateProcessor(concurrency))
+    urls = telegram_urls()
+    if "base_url" in urls:
+        builder = builder.base_url(urls["base_url"])
+    if "base_file_url" in urls:
+        builder = builder.base_file_url(urls["base_file_url"])
+    return builder.build()
+
+
+def run_application(app: Application) -> None:
+    """
+    Serve updates by long polling (BOT_MODE=polling, the default) or through a
+    webhook (BOT_MODE=webhook). Webhook mode listens on WEBHOOK_LISTEN:WEBHOOK_PORT
+    (default 0.0.0.0 and $PORT or 8443) at /WEBHOOK_PATH and registers
+    WEBHOOK_URL/WEBHOOK_PATH with Telegram; WEBHOOK_SECRET, if set, is checked
+    on every request. Needs python-telegram-bot[webhooks].
+
+    Logs a startup report (see runners/startup.py) once updates are being served.
+    """
+    startup.mark("build")
+    post_init = app.post_init
+
+    async def post_init_with_report(application: Application) -> None:
+        if post_init is not None:
+            await post_init(application)
+        startup.mark("initialize")
+        application.create_task(startup.report_when_serving(application))
+
+    app.post_init = post_init_with_report
+
+    mode = os.getenv("BOT_MODE", "polling").lower()
+    if mode == "polling":
+        app.run_polling()
+    elif mode == "webhook":
+        webhook_url = os.getenv("WEBHOOK_URL")
+        if not webhook_url:
+            raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+        url_path = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+        app.run_webhook(
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443"))),
+            url_path=url_path,
+            webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+        )
+    else:
+        raise ValueError(f"Unsupported BOT_MODE: {mode}")
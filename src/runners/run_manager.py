@@ -1,20 +1,19 @@
-from telegram.ext import Application
+from runners import startup  # first, so that the import phase is measured
 from bots.manager_bot import ArgManagerBot
 from redis_helper.helper import RedisHelper
-import logging, os, sys
+from runners.common import build_application, configure_logging, run_application, start_telemetry
+import logging, os
 
 TOKEN = os.getenv("MANAGER_BOT_TOKEN")
 REDIS_URL = os.getenv("REDIS_URL")
 
 if __name__ == "__main__":
-    logging.basicConfig(
-      level=logging.INFO,
-      format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-      handlers=[logging.StreamHandler(sys.stdout)]
-    )
+    startup.mark("imports")
+    configure_logging()
+    start_telemetry()
     logger = logging.getLogger("manager-bot")
     redis = RedisHelper(REDIS_URL)
     bot = ArgManagerBot(logger, redis)
-    app = Application.builder().token(TOKEN).build()
+    app = build_application(TOKEN)
     bot.register_handlers(app)
-    app.run_polling()
+    run_application(app)
@@ -0,0 +1,20 @@
+from runners import startup  # first, so that the import phase is measured
+from telegram import Bot
+from bots.render_worker import RenderWorker
+from redis_helper.helper import RedisHelper
+from runners.common import configure_logging, start_telemetry, telegram_urls
+import asyncio, logging, os
+
+TOKEN = os.getenv("ARG_BOT_TOKEN")
+REDIS_URL = os.getenv("REDIS_URL")
+
+if __name__ == "__main__":
+    startup.mark("imports")
+    configure_logging()
+    start_telemetry()
+    logger = logging.getLogger("render-worker")
+    redis = RedisHelper(REDIS_URL)
+    worker = RenderWorker(logger, redis, Bot(TOKEN, **telegram_urls()))
+    startup.mark("build")
+    startup.report()
+    asyncio.run(worker.run())
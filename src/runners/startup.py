@@ -0,0 +1,51 @@
+"""
+Startup timing for the runners. Import this module before anything else so
+that the import phase is measured from (almost) the start of the process.
+"""
+import asyncio
+import logging
+import time
+
+_started = time.perf_counter()
+_last = _started
+_phases: list = []
+
+logger = logging.getLogger("startup")
+
+
+def mark(phase: str) -> None:
+    """
+    Close the current startup phase under the given name.
+    """
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    _last = now
+
+
+def report() -> None:
+    """
+    Log the recorded phases and export them as the startup_seconds metric.
+    """
+    from telemetry import registry
+
+    phases = registry.histogram(
+        "startup_seconds", "Duration of each startup phase of this process.", ("phase",),
+        buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+    )
+    for phase, seconds in _phases:
+        phases.observe(seconds, phase=phase)
+    phases.observe(_last - _started, phase="total")
+    details = ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in _phases)
+    logger.info(f"Started in {_last - _started:.3f}s ({details})")
+
+
+async def report_when_serving(app) -> None:
+    """
+    Wait until the application's updater is polling (or serving the webhook),
+    then close the "first_poll" phase and log the report.
+    """
+    while app.updater is not None and not app.updater.running:
+        await asyncio.sleep(0.01)
+    mark("first_poll")
+    report()
@@ -0,0 +1,4 @@
+__version__ = "0.1.0"
+
+from .metrics import Counter, Histogram, registry
+from .server import start_metrics_server
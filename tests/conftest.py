@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def helper(monkeypatch):
+    """
+    RedisHelper backed by an in-process fakeredis server.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis.asyncio as redis
+    from fakeredis.aioredis import FakeAsyncRedisConnection
+
+    from redis_helper.helper import RedisHelper
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.ConnectionPool, "from_url",
+        classmethod(lambda cls, url, **kwargs: cls(connection_class=FakeAsyncRedisConnection, server=server, **kwargs)),
+    )
+    return RedisHelper("redis://fake")
@@ -0,0 +1,15 @@
+import pytest
+
+from bots.admission import AdmissionController, AdmissionRejected
+
+
+def test_user_rate_shed_does_not_charge_the_chat():
+    admission = AdmissionController(chat_rate=0.001, chat_burst=2, user_rate=0.001, user_burst=1)
+    admission.check_rate(chat_id=1, user_id=10)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.check_rate(chat_id=1, user_id=10)
+    assert rejected.value.reason == "user_rate"
+
+    # the spamming user was shed without taking the chat's last token
+    admission.check_rate(chat_id=1, user_id=20)
@@ -0,0 +1,32 @@
+import asyncio
+
+from redis_helper.chat_registry import ChatRegistry
+
+
+class RepeatingScan:
+    """
+    Stands in for RedisHelper with an SSCAN that returns some ids twice, as it may
+    while the set is rehashed.
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    async def scan_chat_ids(self, batch_size):
+        for batch in self.batches:
+            yield list(batch)
+
+    async def count_chat_ids(self):
+        return len({chat_id for batch in self.batches for chat_id in batch})
+
+
+def test_rebuild_skips_ids_repeated_by_sscan():
+    registry = ChatRegistry(RepeatingScan([[1, 2, 2], [3, 1], [2]]))
+
+    async def collect():
+        return [chat_id async for batch in registry.iter_batches() for chat_id in batch]
+
+    assert asyncio.run(collect()) == [1, 2, 3]
+    assert len(registry) == 3
+    # the cache now matches SCARD and is served without another scan
+    assert asyncio.run(collect()) == [1, 2, 3]
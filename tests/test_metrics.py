@@ -0,0 +1,21 @@
+import asyncio
+
+from redis.asyncio.client import Pipeline
+
+
+def test_metrics_batch_skips_script_exists_and_survives_script_flush(helper, monkeypatch):
+    def no_script_exists(self):
+        raise AssertionError("save_metrics_batch must not send SCRIPT EXISTS")
+
+    monkeypatch.setattr(Pipeline, "load_scripts", no_script_exists)
+    chat = {"id": -100, "type": "group", "title": "Test"}
+
+    async def scenario():
+        await helper.save_metrics_batch([(chat, 2, {1})])
+        await helper.save_metrics_batch([(chat, 3, {2})])
+        # e.g. Redis restarted without persistence of the script cache
+        await helper.client.script_flush()
+        await helper.save_metrics_batch([(chat, 4, {3})])
+        return await helper.client.hget(f"{helper.METRICS_KEY_PREFIX}:{chat['id']}", "count")
+
+    assert asyncio.run(scenario()) == "9"
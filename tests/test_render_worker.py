@@ -0,0 +1,38 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from bots.render_worker import RenderWorker
+from bots.rendering import OVERLAY_VERSION, EncodeSettings
+
+
+class FakeBot:
+    async def get_file(self, file_id):
+        async def download_as_bytearray():
+            return bytearray(b"jpeg")
+        return SimpleNamespace(download_as_bytearray=download_as_bytearray)
+
+    async def send_photo(self, **kwargs):
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="rendered")])
+
+
+def test_result_is_cached_under_the_settings_the_worker_encoded_with(helper, monkeypatch):
+    monkeypatch.setenv("ARG_JPEG_QUALITY", "90")
+    worker = RenderWorker(logging.getLogger("test"), helper, FakeBot())
+
+    async def render(data, target_resolution=None):
+        return b"stamped"
+
+    monkeypatch.setattr(worker.render_pool, "render", render)
+    job = {"file_id": "f", "file_unique_id": "u", "chat_id": 1, "reply_to_message_id": 2, "target_resolution": 1280}
+
+    async def scenario():
+        await worker.process_job(job)
+        bot_version = f"{OVERLAY_VERSION}:1280:{EncodeSettings().cache_key}"
+        return (
+            await helper.get_cached_result("u", worker.render_pool.result_version(1280)),
+            await helper.get_cached_result("u", bot_version),
+        )
+
+    assert worker.render_pool.encode_settings.quality == 90
+    assert asyncio.run(scenario()) == ("rendered", None)
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from bots.sharding import HashRing
+
+TTL = 30
+
+
+def test_stale_ring_with_dead_peer_does_not_finish_broadcast(helper):
+    async def scenario():
+        entry_id = "1-0"
+        chat_ids = list(range(1, 21))
+        await helper.heartbeat_replica("r1", TTL)
+        # r2 died: its last heartbeat is older than the TTL, but r1 has not refreshed yet
+        await helper.client.zadd(helper.REPLICAS_KEY, {"r2": time.time() - 2 * TTL})
+        await helper.start_broadcast(entry_id)
+
+        stale = HashRing(["r1", "r2"])
+        owned = [chat_id for chat_id in chat_ids if stale.owner(chat_id) == "r1"]
+        assert 0 < len(owned) < len(chat_ids)
+        for chat_id in await helper.claim_broadcast_chats(entry_id, "r1", owned, TTL):
+            await helper.mark_broadcast_sent(entry_id, chat_id)
+
+        assert not await helper.finish_broadcast_pass(entry_id, "r1", stale.epoch, list(stale.replicas), TTL)
+        assert await helper.client.zscore(helper.ACTIVE_BROADCASTS_KEY, entry_id) is not None
+
+        # the rebalance after r1's next refresh serves the rest and finishes it
+        fresh = HashRing(["r1"])
+        rest = await helper.claim_broadcast_chats(entry_id, "r1", chat_ids, TTL)
+        assert sorted(rest) == sorted(set(chat_ids) - set(owned))
+        assert await helper.finish_broadcast_pass(entry_id, "r1", fresh.epoch, list(fresh.replicas), TTL)
+        assert await helper.client.zscore(helper.ACTIVE_BROADCASTS_KEY, entry_id) is None
+        await helper.close()
+
+    asyncio.run(scenario())
+
+
+def test_finish_waits_for_every_live_replica(helper):
+    async def scenario():
+        entry_id = "2-0"
+        await helper.heartbeat_replica("r1", TTL)
+        await helper.heartbeat_replica("r2", TTL)
+        await helper.start_broadcast(entry_id)
+        ring = HashRing(["r1", "r2"])
+
+        assert not await helper.finish_broadcast_pass(entry_id, "r1", ring.epoch, list(ring.replicas), TTL)
+        assert await helper.finish_broadcast_pass(entry_id, "r2", ring.epoch, list(ring.replicas), TTL)
+        assert not await helper.start_broadcast(entry_id)
+        await helper.close()
+
+    asyncio.run(scenario())